@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark
+Compares password checks in the request thread against the hashing pool
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Use a throwaway SQLite database so the benchmark never touches Supabase
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+from src.main import app
+from src.models.gym import db
+from src.utils import passwords
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def seed_users(count):
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    for i in range(count):
+        client.post('/api/auth/register/client', json={
+            'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password': 'bench-password'
+        })
+
+def run_logins(total, concurrency, users):
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def login(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        response = local.client.post('/api/auth/login/client', json={
+            'username': f'bench{i % users}', 'password': 'bench-password'
+        })
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(login, range(total)))
+    wall = time.perf_counter() - started
+
+    return {
+        'requests_per_sec': total / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statuses': statuses
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/auth/login/client throughput')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"🏋️  Seeding {args.users} users...")
+    passwords.USE_HASH_POOL = False
+    seed_users(args.users)
+
+    for label, use_pool in (('inline (request thread)', False), ('hashing pool', True)):
+        passwords.USE_HASH_POOL = use_pool
+        run_logins(min(args.requests, args.concurrency * 2), args.concurrency, args.users)  # warm up
+        result = run_logins(args.requests, args.concurrency, args.users)
+        print(f"{label:<24} {result['requests_per_sec']:8.1f} req/s   "
+              f"p50 {result['p50_ms']:7.1f} ms   p99 {result['p99_ms']:7.1f} ms   statuses {result['statuses']}")
+
+    passwords.hash_pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Media delivery benchmark
+Runs one gunicorn worker per MEDIA_SENDFILE_MODE and measures how many
+concurrent video streams (random 1 MB range reads, as players do while
+seeking) it sustains
+"""
+
+import argparse
+import http.client
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+BENCH_DIR = os.path.join(ROOT, 'src', 'uploads', 'bench')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def start_worker(mode, port, threads):
+    env = dict(os.environ,
+               MEDIA_SENDFILE_MODE=mode,
+               DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'),
+               SCAN_WRITE_BEHIND='0')
+    proc = subprocess.Popen(
+        ['gunicorn', '-w', '1', '-k', 'gthread', '--threads', str(threads),
+         '-b', f'127.0.0.1:{port}', 'src.main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'gunicorn did not start for mode {mode}')
+
+def run_streams(port, path, size, streams, duration, chunk):
+    latencies = []
+    statuses = {}
+    transferred = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def stream(_):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.time() < stop_at:
+            start = random.randrange(0, max(1, size - chunk))
+            started = time.perf_counter()
+            conn.request('GET', path, headers={'Range': f'bytes={start}-{start + chunk - 1}'})
+            response = conn.getresponse()
+            body = response.read()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                transferred[0] += len(body)
+        conn.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+        list(executor.map(stream, range(streams)))
+    wall = time.perf_counter() - started
+
+    return {
+        'requests_per_sec': len(latencies) / wall,
+        'mb_per_sec': transferred[0] / wall / 1e6,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statuses': statuses
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/uploads media delivery')
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--streams', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--chunk-kb', type=int, default=1024)
+    parser.add_argument('--modes', nargs='+', default=['none', 'x-accel'])
+    parser.add_argument('--port', type=int, default=5077)
+    args = parser.parse_args()
+
+    # x-accel only measures the worker's share: nginx would send the bytes
+    print(f"🎬 Writing a {args.size_mb} MB test video...")
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    size = args.size_mb * 1024 * 1024
+    with open(os.path.join(BENCH_DIR, 'bench.mp4'), 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    try:
+        for mode in args.modes:
+            proc = start_worker(mode, args.port, args.threads)
+            try:
+                for streams in args.streams:
+                    result = run_streams(args.port, '/api/uploads/bench/bench.mp4', size, streams,
+                                         args.duration, args.chunk_kb * 1024)
+                    print(f"{mode:<10} {streams:4d} streams {result['requests_per_sec']:8.1f} req/s "
+                          f"{result['mb_per_sec']:8.1f} MB/s   p50 {result['p50_ms']:7.1f} ms   "
+                          f"p99 {result['p99_ms']:7.1f} ms   statuses {result['statuses']}")
+            finally:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait()
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Prepare the frontend build for deployment
+Writes .gz (and .br when brotli is installed) next to every compressible
+file in src/static, then hashes the files into src/static/.static-manifest.json,
+so workers start without compressing or hashing anything. Run it where the
+files will be served from: entries whose size or mtime change afterwards fall
+back to stat-based ETags.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.static_manifest import MANIFEST_NAME, StaticManifest, precompress, brotli
+
+DEFAULT_STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'src', 'static')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompress static assets and write the static manifest')
+    parser.add_argument('--static-dir', default=DEFAULT_STATIC_DIR)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.static_dir):
+        print(f"❌ Static folder not found: {args.static_dir}")
+        sys.exit(1)
+    if brotli is None:
+        print("⚠️  brotli is not installed; writing gzip variants only")
+
+    manifest = StaticManifest(args.static_dir)
+    manifest.build()
+    written = 0
+    for entry in manifest.entries.values():
+        written += len(precompress(entry['path']))
+    manifest.build()
+    manifest.save()
+
+    original = sum(entry['size'] for entry in manifest.entries.values())
+    smallest = sum(min([entry['size']] + [size for _, size in entry['variants'].values()])
+                   for entry in manifest.entries.values())
+    immutable = sum(1 for entry in manifest.entries.values() if 'immutable' in entry['cache_control'])
+    print(f"✅ {len(manifest.entries)} files ({immutable} fingerprinted), {written} variants written")
+    print(f"   {original / 1024:.1f} KiB on disk, {smallest / 1024:.1f} KiB over the wire with compression")
+    print(f"   Manifest written to {os.path.join(args.static_dir, MANIFEST_NAME)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Database schema migrations
+  python scripts/migrate.py status    - list migrations and when they were applied
+  python scripts/migrate.py upgrade   - apply pending migrations (--to VERSION to stop early)
+  python scripts/migrate.py check     - EXPLAIN the hot queries and verify they use their indexes
+Uses DATABASE_URL, like the app
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.main import app
+from src.models.gym import db
+from src.migrations import runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the database schema')
+    parser.add_argument('command', choices=['status', 'upgrade', 'check'])
+    parser.add_argument('--to', dest='target', help='stop after this migration version')
+    parser.add_argument('--verbose', action='store_true', help='print query plans')
+    args = parser.parse_args()
+
+    with app.app_context():
+        engine = db.engine
+        if args.command == 'status':
+            for migration in runner.status(engine):
+                applied = migration['applied_at']
+                mark = f"✅ applied {applied}" if applied else "⏳ pending"
+                print(f"{migration['version']}  {migration['description']:<55} {mark}")
+
+        elif args.command == 'upgrade':
+            applied = runner.upgrade(engine, target=args.target)
+            print(f"✅ Applied {len(applied)} migration(s)" if applied else "✅ Schema is up to date")
+
+        elif args.command == 'check':
+            failures = 0
+            for name, ok, plan in runner.check_indexes(engine):
+                print(f"{'✅' if ok else '❌'} {name}")
+                if args.verbose or not ok:
+                    print('    ' + plan.replace('\n', '\n    '))
+                failures += not ok
+            if failures:
+                print(f"❌ {failures} query(ies) cannot use their index; run 'upgrade'")
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
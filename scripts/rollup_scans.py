@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Backfill or repair the daily scan rollups
+  python scripts/rollup_scans.py --days 7          - recompute the last 7 days
+  python scripts/rollup_scans.py --since 2025-01-01 --gym 3
+  python scripts/rollup_scans.py --all             - recompute all history
+  python scripts/rollup_scans.py --days 30 --verify  - only compare rollups with scan_history
+Uses DATABASE_URL, like the app
+"""
+
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import func, select
+from src.main import app
+from src.models.gym import db, GymMachine, ScanDailyRollup, ScanHistory
+from src.utils.rollups import rebuild_rollups, window_start_day
+
+
+def compare(start_day, gym_id):
+    """Return [(machine_id, day, rollup count, raw count)] where the two disagree."""
+    day = func.date(ScanHistory.scan_timestamp)
+    raw = select(ScanHistory.machine_id, day, func.count(ScanHistory.id)).join(
+        GymMachine, ScanHistory.machine_id == GymMachine.id
+    ).group_by(ScanHistory.machine_id, day)
+    rolled = select(ScanDailyRollup.machine_id, ScanDailyRollup.day, ScanDailyRollup.scan_count)
+    if start_day is not None:
+        raw = raw.where(ScanHistory.scan_timestamp >= start_day)
+        rolled = rolled.where(ScanDailyRollup.day >= start_day)
+    if gym_id is not None:
+        raw = raw.where(GymMachine.gym_id == gym_id)
+        rolled = rolled.where(ScanDailyRollup.gym_id == gym_id)
+
+    def normalize(rows):
+        return {(machine_id, str(scan_day)): count for machine_id, scan_day, count in rows if count}
+
+    raw_counts = normalize(db.session.execute(raw))
+    rolled_counts = normalize(db.session.execute(rolled))
+    return [
+        (machine_id, scan_day, rolled_counts.get((machine_id, scan_day), 0), raw_counts.get((machine_id, scan_day), 0))
+        for machine_id, scan_day in sorted(set(raw_counts) | set(rolled_counts))
+        if rolled_counts.get((machine_id, scan_day), 0) != raw_counts.get((machine_id, scan_day), 0)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill or repair scan_daily_rollups from scan_history')
+    window = parser.add_mutually_exclusive_group(required=True)
+    window.add_argument('--days', type=int, help='recompute this many trailing days')
+    window.add_argument('--since', type=date.fromisoformat, help='recompute from this UTC day (YYYY-MM-DD)')
+    window.add_argument('--all', action='store_true', help='recompute all history')
+    parser.add_argument('--gym', type=int, help='only this gym')
+    parser.add_argument('--verify', action='store_true', help='report mismatches without writing')
+    args = parser.parse_args()
+
+    start_day = window_start_day(args.days) if args.days is not None else args.since
+
+    with app.app_context():
+        if args.verify:
+            mismatches = compare(start_day, args.gym)
+            for machine_id, scan_day, rolled, raw in mismatches:
+                print(f"❌ machine {machine_id} on {scan_day}: rollup {rolled}, scan_history {raw}")
+            print(f"{'❌' if mismatches else '✅'} {len(mismatches)} mismatched machine-day(s)")
+            sys.exit(1 if mismatches else 0)
+
+        # One transaction: readers see the old rollups until the new ones commit
+        with db.engine.begin() as connection:
+            written = rebuild_rollups(connection, start_day=start_day, gym_id=args.gym)
+        print(f"✅ Rebuilt {written} rollup row(s) from {start_day or 'the beginning'}")
+
+if __name__ == '__main__':
+    main()
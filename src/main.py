@@ -1,3 +1,4 @@
+import hmac
 import os
 import sys
 
@@ -5,15 +6,24 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask, request
 from flask_cors import CORS
 from src.models.gym import db
-from src.routes.auth import auth_bp
+from src.routes.auth import auth_bp, principal_cache, verified_token_cache
+from src.utils.passwords import hash_pool
+from src.utils.qr_render import render_pool
+from src.utils.scan_recorder import scan_recorder
+from src.utils.scan_cards import scan_card_cache
+from src.utils.rollups import stale_days
+from src.utils.media import send_media
+from src.utils.static_manifest import StaticManifest, send_static_entry
 from src.routes.gym_management import gym_bp
-from src.routes.qr_management import qr_bp
+from src.routes.machine_transfer import machine_transfer_bp
+from src.routes.qr_management import qr_bp, qr_payload_cache, validate_limiter
 from src.routes.client_features import client_bp
-from src.routes.analytics import analytics_bp
+from src.routes.analytics import analytics_bp, overview_cache
 from src.routes.translation_proxy import translation_proxy_bp
+from src.routes.video_uploads import video_upload_bp
 from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
@@ -23,16 +33,21 @@ app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'sta
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
 
 
+static_manifest = StaticManifest(app.static_folder)
+static_manifest.load()
+
 # Enable CORS for all routes
 CORS(app, origins="*")
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(gym_bp, url_prefix='/api')
+app.register_blueprint(machine_transfer_bp, url_prefix='/api')
 app.register_blueprint(qr_bp, url_prefix='/api')
 app.register_blueprint(client_bp, url_prefix='/api/client')
 app.register_blueprint(analytics_bp, url_prefix='/api')
 app.register_blueprint(translation_proxy_bp, url_prefix='/api/translation')
+app.register_blueprint(video_upload_bp, url_prefix='/api')
 
 # Database configuration
 # app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
@@ -41,7 +56,9 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///dat
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
+scan_recorder.init_app(app)
 
+# Schema changes are applied with `python scripts/migrate.py upgrade`
 # with app.app_context():
 #     db.create_all()
 
@@ -52,28 +69,62 @@ def serve(path):
     if static_folder_path is None:
             return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
+    # Unknown paths fall back to index.html so the SPA router can handle them
+    entry = static_manifest.lookup(path) if path != "" else None
+    if entry is None:
+        entry = static_manifest.lookup('index.html')
+    if entry is None:
+        return "index.html not found", 404
+    try:
+        return send_static_entry(entry)
+    except FileNotFoundError:
+        # Removed under a running worker; forget it and serve whatever is there now
+        static_manifest.forget(path)
+        static_manifest.forget('index.html')
+        entry = static_manifest.lookup(path) or static_manifest.lookup('index.html')
+        if entry is None:
             return "index.html not found", 404
+        return send_static_entry(entry)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return {'status': 'healthy', 'message': 'Gym Platform API is running'}, 200
 
+# Internal counters are only served when METRICS_TOKEN is set, and only to
+# requests that present it in X-Metrics-Token; otherwise the route does not exist
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    if not METRICS_TOKEN:
+        return {'message': 'Not found'}, 404
+    if not hmac.compare_digest(request.headers.get('X-Metrics-Token', ''), METRICS_TOKEN):
+        return {'message': 'Unauthorized'}, 401
+    # Per-worker counters; each gunicorn worker reports its own view
+    return {
+        'pid': os.getpid(),
+        'principal_cache': principal_cache.stats(),
+        'verified_token_cache': verified_token_cache.stats(),
+        'password_hash_pool': hash_pool.stats(),
+        'qr_render_pool': render_pool.stats(),
+        'qr_payload_cache': qr_payload_cache.stats(),
+        'scan_recorder': scan_recorder.stats(),
+        'rollup_stale_days': [str(day) for day in stale_days()],
+        'scan_card_cache': scan_card_cache.stats(),
+        'qr_validate_limiter': validate_limiter.stats(),
+        'static_manifest': static_manifest.stats(),
+        'analytics_overview_cache': overview_cache.stats()
+    }, 200
+
 @app.route('/videos/<path:filename>')
 def serve_video(filename):
     video_folder = os.path.join(app.static_folder, 'videos')
-    return send_from_directory(video_folder, filename)
+    return send_media(video_folder, filename, 'videos')
 
 @app.route('/api/uploads/<path:filename>')
 def serve_upload(filename):
     upload_folder = os.path.join(os.path.dirname(__file__), 'uploads')
-    return send_from_directory(upload_folder, filename)
+    return send_media(upload_folder, filename, 'uploads')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
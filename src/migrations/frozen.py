@@ -0,0 +1,100 @@
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text, UniqueConstraint
+
+# Tables exactly as the migrations that create them shipped. Migrations build
+# from these, never from the live models, so a fresh database replays the real
+# history: later migrations add the indexes, cascades and columns the models
+# have today. Never edit a table here once its migration has shipped.
+
+metadata = MetaData()
+
+# 0001: the schema before migrations existed
+gym_owners = Table(
+    'gym_owners', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(255), nullable=False),
+    Column('created_at', DateTime)
+)
+
+gym_clients = Table(
+    'gym_clients', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(255), nullable=False),
+    Column('created_at', DateTime)
+)
+
+gyms = Table(
+    'gyms', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('owner_id', Integer, ForeignKey('gym_owners.id'), nullable=False),
+    Column('name', String(100), nullable=False),
+    Column('logo_url', String(255)),
+    Column('contact_info', Text),
+    Column('created_at', DateTime)
+)
+
+gym_machines = Table(
+    'gym_machines', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('gym_id', Integer, ForeignKey('gyms.id'), nullable=False),
+    Column('name', String(100), nullable=False),
+    Column('how_to_use_video_url', String(255)),
+    Column('local_video_path', String(255)),
+    Column('safety_tips', Text),
+    Column('usage_guide', Text),
+    Column('created_at', DateTime)
+)
+
+qr_codes = Table(
+    'qr_codes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('machine_id', Integer, ForeignKey('gym_machines.id'), nullable=False),
+    Column('qr_code_data', Text, nullable=False),
+    Column('token', String(255), unique=True, nullable=False),
+    Column('created_at', DateTime)
+)
+
+multilingual_content = Table(
+    'multilingual_content', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('machine_id', Integer, ForeignKey('gym_machines.id'), nullable=False),
+    Column('language_code', String(10), nullable=False),
+    Column('instruction_text', Text),
+    Column('safety_text', Text),
+    Column('created_at', DateTime)
+)
+
+scan_history = Table(
+    'scan_history', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('client_id', Integer, ForeignKey('gym_clients.id'), nullable=False),
+    Column('machine_id', Integer, ForeignKey('gym_machines.id'), nullable=False),
+    Column('scan_timestamp', DateTime)
+)
+
+bookmarked_machines = Table(
+    'bookmarked_machines', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('client_id', Integer, ForeignKey('gym_clients.id'), nullable=False),
+    Column('machine_id', Integer, ForeignKey('gym_machines.id'), nullable=False),
+    Column('bookmark_timestamp', DateTime),
+    UniqueConstraint('client_id', 'machine_id', name='unique_client_machine_bookmark')
+)
+
+BASELINE_TABLES = [
+    gym_owners, gym_clients, gyms, gym_machines, qr_codes,
+    multilingual_content, scan_history, bookmarked_machines
+]
+
+# 0005: daily rollups, before 0006 added client_sketch
+scan_daily_rollups = Table(
+    'scan_daily_rollups', metadata,
+    Column('machine_id', Integer, ForeignKey('gym_machines.id', ondelete='CASCADE'), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('gym_id', Integer, ForeignKey('gyms.id', ondelete='CASCADE'), nullable=False),
+    Column('scan_count', Integer, nullable=False, default=0),
+    Index('ix_scan_daily_rollups_gym_day', 'gym_id', 'day')
+)
@@ -0,0 +1,77 @@
+from sqlalchemy import inspect, text
+
+# Building blocks for migrations. Each one is a no-op when the change is
+# already there, so a migration can be re-run against a database that was
+# partly set up by hand or by an older db.create_all().
+
+
+def is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+def has_table(connection, table):
+    return inspect(connection).has_table(table)
+
+def has_index(connection, table, name):
+    return any(index['name'] == name for index in inspect(connection).get_indexes(table))
+
+def has_column(connection, table, column):
+    return any(col['name'] == column for col in inspect(connection).get_columns(table))
+
+def index_state(connection, table, name):
+    """None if the index is missing, else whether it is usable. On PostgreSQL a
+    failed CREATE INDEX CONCURRENTLY leaves the index behind marked INVALID."""
+    if not is_postgres(connection):
+        return True if has_index(connection, table, name) else None
+    return connection.execute(text(
+        'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'
+    ), {'name': name}).scalar()
+
+def create_index(connection, name, table, columns, unique=False):
+    """CREATE INDEX IF NOT EXISTS; concurrently on PostgreSQL when the migration
+    runs outside a transaction, so large tables stay writable while it builds.
+    An INVALID index left by an interrupted build is dropped and built again."""
+    autocommit = connection.get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+    concurrently = 'CONCURRENTLY ' if is_postgres(connection) and autocommit else ''
+    state = index_state(connection, table, name)
+    if state:
+        return False
+    if state is False:
+        connection.execute(text(f'DROP INDEX {concurrently}IF EXISTS {name}'))
+    connection.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})"
+    ))
+    return True
+
+def drop_index(connection, name, table):
+    if not has_index(connection, table, name):
+        return False
+    connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    return True
+
+def add_column(connection, table, column, ddl):
+    if has_column(connection, table, column):
+        return False
+    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    return True
+
+def set_foreign_key_ondelete(connection, table, column, referred_table, ondelete='CASCADE'):
+    """Recreate the foreign key on table.column with ON DELETE <ondelete> (PostgreSQL only;
+    SQLite cannot alter constraints in place). NOT VALID + VALIDATE keeps the
+    exclusive lock short on big tables."""
+    if not is_postgres(connection):
+        return False
+    for fk in inspect(connection).get_foreign_keys(table):
+        if fk['constrained_columns'] != [column] or fk['referred_table'] != referred_table:
+            continue
+        if (fk.get('options') or {}).get('ondelete', '').upper() == ondelete:
+            return False
+        name = fk['name']
+        connection.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT {name}'))
+        connection.execute(text(
+            f'ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) '
+            f'REFERENCES {referred_table} (id) ON DELETE {ondelete} NOT VALID'
+        ))
+        connection.execute(text(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}'))
+        return True
+    return False
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from src.migrations.versions import MIGRATIONS
+
+VERSION_TABLE = 'schema_migrations'
+
+# Representative hot queries and the index each one must be able to use.
+# (name, SQL, parameters, indexes any of which satisfies the check)
+INDEX_CHECKS = [
+    ('machine usage window',
+     'SELECT COUNT(*) FROM scan_history WHERE machine_id = :machine_id AND scan_timestamp >= :since',
+     {'machine_id': 1}, ['ix_scan_history_machine_time']),
+    ('gym scans (overview, daily scans, popular machines)',
+     'SELECT COUNT(scan_history.id) FROM scan_history JOIN gym_machines ON gym_machines.id = scan_history.machine_id '
+     'WHERE gym_machines.gym_id = :gym_id AND scan_history.scan_timestamp >= :since',
+     {'gym_id': 1}, ['ix_scan_history_machine_time']),
+    ('client scan history',
+     'SELECT id FROM scan_history WHERE client_id = :client_id ORDER BY scan_timestamp DESC LIMIT 20',
+     {'client_id': 1}, ['ix_scan_history_client_time']),
+    ('machines of a gym',
+     'SELECT id FROM gym_machines WHERE gym_id = :gym_id',
+     {'gym_id': 1}, ['ix_gym_machines_gym_id']),
+    ('multilingual content of a machine',
+     'SELECT id FROM multilingual_content WHERE machine_id = :machine_id',
+     {'machine_id': 1}, ['ix_multilingual_content_machine_id']),
+    ('gym of an owner',
+     'SELECT id FROM gyms WHERE owner_id = :owner_id',
+     {'owner_id': 1}, ['ix_gyms_owner_id']),
+]
+
+
+def ensure_version_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ('
+            'version VARCHAR(32) PRIMARY KEY, '
+            'description VARCHAR(255) NOT NULL, '
+            'applied_at TIMESTAMP NOT NULL)'
+        ))
+
+def applied_versions(engine):
+    ensure_version_table(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(text(f'SELECT version, applied_at FROM {VERSION_TABLE}'))
+        return {version: applied_at for version, applied_at in rows}
+
+def status(engine):
+    applied = applied_versions(engine)
+    return [
+        {'version': version, 'description': description, 'applied_at': applied.get(version)}
+        for version, description, _, _ in MIGRATIONS
+    ]
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+def _record(connection, version, description):
+    connection.execute(
+        text(f'INSERT INTO {VERSION_TABLE} (version, description, applied_at) VALUES (:v, :d, :t)'),
+        {'v': version, 'd': description, 't': datetime.utcnow()}
+    )
+
+def upgrade(engine, target=None, log=print):
+    """Apply pending migrations in order, up to and including target."""
+    applied = []
+    for version, description, migrate, transactional in pending_migrations(engine):
+        if target is not None and version > target:
+            break
+        log(f"Applying {version}: {description}")
+        if transactional:
+            with engine.begin() as connection:
+                migrate(connection)
+                _record(connection, version, description)
+        else:
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                migrate(connection)
+            with engine.begin() as connection:
+                _record(connection, version, description)
+        applied.append(version)
+    return applied
+
+def _explain(connection, sql, params):
+    if connection.dialect.name == 'postgresql':
+        # Tiny or fresh tables make sequential scans cheapest; the check is
+        # whether the planner *can* use the index, so take that option away
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+        rows = connection.execute(text(f'EXPLAIN {sql}'), params)
+    else:
+        rows = connection.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params)
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+def check_indexes(engine):
+    """EXPLAIN each hot query; returns [(name, ok, plan)]."""
+    results = []
+    since = datetime.utcnow() - timedelta(days=30)
+    for name, sql, params, indexes in INDEX_CHECKS:
+        try:
+            with engine.begin() as connection:
+                plan = _explain(connection, sql, dict(params, since=since))
+        except Exception as e:
+            # Usually a table that a pending migration would create
+            results.append((name, False, f'EXPLAIN failed: {e}'.splitlines()[0]))
+            continue
+        results.append((name, any(index in plan for index in indexes), plan))
+    return results
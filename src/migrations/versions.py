@@ -0,0 +1,107 @@
+from sqlalchemy import text
+from src.migrations import frozen
+from src.migrations.ops import create_index, set_foreign_key_ondelete, add_column, is_postgres
+from src.utils.hll import HyperLogLog
+
+# Ordered schema history. Each entry is (version, description, upgrade, transactional);
+# upgrade(connection) receives a SQLAlchemy connection. Non-transactional
+# migrations run in autocommit mode (needed for CREATE INDEX CONCURRENTLY).
+# Append new migrations at the end and never edit one that has shipped.
+
+
+def baseline(connection):
+    # The schema as it stood before migrations existed; existing tables are left alone
+    frozen.metadata.create_all(connection, tables=frozen.BASELINE_TABLES, checkfirst=True)
+
+def hot_query_indexes(connection):
+    create_index(connection, 'ix_scan_history_machine_time', 'scan_history', ['machine_id', 'scan_timestamp'])
+    create_index(connection, 'ix_scan_history_client_time', 'scan_history', ['client_id', 'scan_timestamp'])
+    create_index(connection, 'ix_gym_machines_gym_id', 'gym_machines', ['gym_id'])
+    create_index(connection, 'ix_multilingual_content_machine_id', 'multilingual_content', ['machine_id'])
+    create_index(connection, 'ix_gyms_owner_id', 'gyms', ['owner_id'])
+    create_index(connection, 'ix_qr_codes_machine_id', 'qr_codes', ['machine_id'])
+
+def cascade_child_deletes(connection):
+    for table, column, referred_table in [
+        ('scan_history', 'machine_id', 'gym_machines'),
+        ('scan_history', 'client_id', 'gym_clients'),
+        ('bookmarked_machines', 'machine_id', 'gym_machines'),
+        ('bookmarked_machines', 'client_id', 'gym_clients'),
+        ('multilingual_content', 'machine_id', 'gym_machines'),
+        ('qr_codes', 'machine_id', 'gym_machines'),
+    ]:
+        set_foreign_key_ondelete(connection, table, column, referred_table)
+
+def unique_machine_language(connection):
+    # Delete-and-reinsert updates could leave duplicates behind; keep the newest row
+    connection.execute(text(
+        'DELETE FROM multilingual_content WHERE id NOT IN ('
+        'SELECT MAX(id) FROM multilingual_content GROUP BY machine_id, language_code)'
+    ))
+    create_index(connection, 'uq_multilingual_content_machine_language', 'multilingual_content',
+                 ['machine_id', 'language_code'], unique=True)
+
+def scan_daily_rollups(connection):
+    frozen.scan_daily_rollups.create(connection, checkfirst=True)
+    # Backfill as of this migration (client_sketch only arrives in 0006, which fills it)
+    connection.execute(text('DELETE FROM scan_daily_rollups'))
+    connection.execute(text(
+        'INSERT INTO scan_daily_rollups (gym_id, machine_id, day, scan_count) '
+        'SELECT m.gym_id, s.machine_id, date(s.scan_timestamp), COUNT(s.id) '
+        'FROM scan_history s JOIN gym_machines m ON s.machine_id = m.id '
+        'GROUP BY m.gym_id, s.machine_id, date(s.scan_timestamp)'
+    ))
+
+def rollup_client_sketches(connection, batch_size=1000):
+    add_column(connection, 'scan_daily_rollups', 'client_sketch', 'BYTEA' if is_postgres(connection) else 'BLOB')
+    # One sketch per (machine, day) from the distinct clients that scanned it,
+    # streamed in order so only one sketch is in memory at a time. The sketch
+    # bytes are a stored format, so HyperLogLog must keep reading what this writes.
+    update = text(
+        'UPDATE scan_daily_rollups SET client_sketch = :sketch '
+        'WHERE machine_id = :machine_id AND day = :day'
+    )
+    rows = connection.execution_options(stream_results=True, yield_per=batch_size).execute(text(
+        'SELECT DISTINCT machine_id, date(scan_timestamp) AS day, client_id FROM scan_history '
+        'ORDER BY machine_id, day'
+    ))
+    pending = []
+    current, sketch = None, None
+    for machine_id, day, client_id in rows:
+        if (machine_id, day) != current:
+            if current is not None:
+                pending.append({'machine_id': current[0], 'day': current[1], 'sketch': sketch.to_bytes()})
+            current, sketch = (machine_id, day), HyperLogLog()
+        sketch.add(client_id)
+        if len(pending) >= batch_size:
+            connection.execute(update, pending)
+            pending = []
+    if current is not None:
+        pending.append({'machine_id': current[0], 'day': current[1], 'sketch': sketch.to_bytes()})
+    if pending:
+        connection.execute(update, pending)
+
+def refresh_token_revocation(connection):
+    add_column(connection, 'gym_owners', 'token_version', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(connection, 'gym_clients', 'token_version', 'INTEGER NOT NULL DEFAULT 0')
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS refresh_tokens ('
+        'jti VARCHAR(64) PRIMARY KEY, '
+        'user_type VARCHAR(10) NOT NULL, '
+        'user_id INTEGER NOT NULL, '
+        'expires_at TIMESTAMP NOT NULL, '
+        'used_at TIMESTAMP, '
+        'created_at TIMESTAMP)'
+    ))
+    create_index(connection, 'ix_refresh_tokens_user', 'refresh_tokens', ['user_type', 'user_id'])
+
+
+MIGRATIONS = [
+    ('0001', 'Baseline schema', baseline, True),
+    ('0002', 'Indexes for analytics, history and owner lookups', hot_query_indexes, False),
+    ('0003', 'ON DELETE CASCADE for machine and client children', cascade_child_deletes, True),
+    ('0004', 'Unique multilingual content per machine and language', unique_machine_language, True),
+    ('0005', 'Daily per-machine scan rollups, backfilled from scan_history', scan_daily_rollups, True),
+    ('0006', 'Distinct-client sketches on the daily rollups', rollup_client_sketches, True),
+    ('0007', 'Single-use refresh tokens and per-user token versions', refresh_token_revocation, True),
+]
@@ -13,6 +13,8 @@ class Gym(db.Model):
     contact_info = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_gyms_owner_id', 'owner_id'),)
+    
     # Relationships
     owner = db.relationship('GymOwner', backref='gym')
     machines = db.relationship('GymMachine', backref='gym', cascade='all, delete-orphan')
@@ -34,6 +36,8 @@ class GymOwner(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    # Embedded in refresh tokens; bumping it revokes every one issued before
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -51,11 +55,14 @@ class GymClient(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    # Embedded in refresh tokens; bumping it revokes every one issued before
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationships
-    scan_history = db.relationship('ScanHistory', backref='client', cascade='all, delete-orphan')
-    bookmarks = db.relationship('BookmarkedMachine', backref='client', cascade='all, delete-orphan')
+    # Relationships. Child rows go with ON DELETE CASCADE instead of being loaded
+    # and deleted one by one; src/utils/purge.py deletes them in chunks explicitly.
+    scan_history = db.relationship('ScanHistory', backref='client', cascade='all, delete-orphan', passive_deletes=True)
+    bookmarks = db.relationship('BookmarkedMachine', backref='client', cascade='all, delete-orphan', passive_deletes=True)
     
     def to_dict(self):
         return {
@@ -77,38 +84,43 @@ class GymMachine(db.Model):
     usage_guide = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationships
-    qr_code = db.relationship('QRCode', backref='machine', uselist=False, cascade='all, delete-orphan')
-    multilingual_content = db.relationship('MultilingualContent', backref='machine', cascade='all, delete-orphan')
-    scan_history = db.relationship('ScanHistory', backref='machine', cascade='all, delete-orphan')
-    bookmarks = db.relationship('BookmarkedMachine', backref='machine', cascade='all, delete-orphan')
-    
-    def to_dict(self):
-        # Adjust local_video_path to remove 'static/' prefix if present
-        local_video_path = self.local_video_path
-        if local_video_path and local_video_path.startswith('static/'):
-            local_video_path = local_video_path[len('static/'):]
-
-        return {
-            'id': self.id,
-            'gym_id': self.gym_id,
-            'name': self.name,
-            'how_to_use_video_url': self.how_to_use_video_url,
-            'local_video_path': local_video_path,
-            'safety_tips': self.safety_tips,
-            'usage_guide': self.usage_guide,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    # Relationships (see GymClient on passive_deletes)
+    qr_code = db.relationship('QRCode', backref='machine', uselist=False, cascade='all, delete-orphan', passive_deletes=True)
+    multilingual_content = db.relationship('MultilingualContent', backref='machine', cascade='all, delete-orphan', passive_deletes=True)
+    scan_history = db.relationship('ScanHistory', backref='machine', cascade='all, delete-orphan', passive_deletes=True)
+    bookmarks = db.relationship('BookmarkedMachine', backref='machine', cascade='all, delete-orphan', passive_deletes=True)
+    
+    __table_args__ = (db.Index('ix_gym_machines_gym_id', 'gym_id'),)
+    
+    SERIALIZED_FIELDS = (
+        'id', 'gym_id', 'name', 'how_to_use_video_url', 'local_video_path',
+        'safety_tips', 'usage_guide', 'created_at'
+    )
+    
+    def to_dict(self, fields=None):
+        # Only the requested columns are touched, so deferred ones stay unloaded
+        data = {}
+        for field in self.SERIALIZED_FIELDS if fields is None else fields:
+            value = getattr(self, field)
+            # Adjust local_video_path to remove 'static/' prefix if present
+            if field == 'local_video_path' and value and value.startswith('static/'):
+                value = value[len('static/'):]
+            elif field == 'created_at':
+                value = value.isoformat() if value else None
+            data[field] = value
+        return data
 
 class QRCode(db.Model):
     __tablename__ = 'qr_codes'
     
     id = db.Column(db.Integer, primary_key=True)
-    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id'), nullable=False)
+    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id', ondelete='CASCADE'), nullable=False)
     qr_code_data = db.Column(db.Text, nullable=False)  # Encrypted data
     token = db.Column(db.String(255), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_qr_codes_machine_id', 'machine_id'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -121,12 +133,18 @@ class MultilingualContent(db.Model):
     __tablename__ = 'multilingual_content'
     
     id = db.Column(db.Integer, primary_key=True)
-    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id'), nullable=False)
+    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id', ondelete='CASCADE'), nullable=False)
     language_code = db.Column(db.String(10), nullable=False)  # e.g., 'en', 'es', 'fr'
     instruction_text = db.Column(db.Text, nullable=True)
     safety_text = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # One row per language per machine; updates are diffed against it (src/utils/multilingual.py)
+    __table_args__ = (
+        db.Index('ix_multilingual_content_machine_id', 'machine_id'),
+        db.Index('uq_multilingual_content_machine_language', 'machine_id', 'language_code', unique=True),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -141,10 +159,16 @@ class ScanHistory(db.Model):
     __tablename__ = 'scan_history'
     
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('gym_clients.id'), nullable=False)
-    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('gym_clients.id', ondelete='CASCADE'), nullable=False)
+    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id', ondelete='CASCADE'), nullable=False)
     scan_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Per-machine analytics and per-client history both filter on a time window
+    __table_args__ = (
+        db.Index('ix_scan_history_machine_time', 'machine_id', 'scan_timestamp'),
+        db.Index('ix_scan_history_client_time', 'client_id', 'scan_timestamp'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -153,12 +177,48 @@ class ScanHistory(db.Model):
             'scan_timestamp': self.scan_timestamp.isoformat() if self.scan_timestamp else None
         }
 
+class ScanDailyRollup(db.Model):
+    """Scans per machine per UTC day, kept current as scans are recorded
+    (src/utils/rollups.py) so analytics never re-aggregate scan_history."""
+    __tablename__ = 'scan_daily_rollups'
+    
+    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gyms.id', ondelete='CASCADE'), nullable=False)
+    scan_count = db.Column(db.Integer, nullable=False, default=0)
+    # HyperLogLog sketch of the day's distinct clients (src/utils/hll.py)
+    client_sketch = db.Column(db.LargeBinary, nullable=True)
+    
+    __table_args__ = (db.Index('ix_scan_daily_rollups_gym_day', 'gym_id', 'day'),)
+    
+    def to_dict(self):
+        return {
+            'machine_id': self.machine_id,
+            'gym_id': self.gym_id,
+            'day': self.day.isoformat() if self.day else None,
+            'scan_count': self.scan_count
+        }
+
+class RefreshToken(db.Model):
+    """Issued refresh tokens by id (jti). /api/auth/refresh accepts each one
+    once and issues its replacement."""
+    __tablename__ = 'refresh_tokens'
+    
+    jti = db.Column(db.String(64), primary_key=True)
+    user_type = db.Column(db.String(10), nullable=False)  # 'owner' or 'client'
+    user_id = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    used_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_refresh_tokens_user', 'user_type', 'user_id'),)
+
 class BookmarkedMachine(db.Model):
     __tablename__ = 'bookmarked_machines'
     
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('gym_clients.id'), nullable=False)
-    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('gym_clients.id', ondelete='CASCADE'), nullable=False)
+    machine_id = db.Column(db.Integer, db.ForeignKey('gym_machines.id', ondelete='CASCADE'), nullable=False)
     bookmark_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Unique constraint to prevent duplicate bookmarks
@@ -1,56 +1,157 @@
-from flask import Blueprint, request, jsonify
-from src.models.gym import db, ScanHistory, GymMachine, Gym
-from src.routes.auth import token_required
-from sqlalchemy import func, desc
-from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from src.models.gym import db, ScanHistory, ScanDailyRollup, GymMachine, Gym
+from src.routes.auth import token_required, get_owner_gym
+from src.utils.cache import TTLCache
+from src.utils.purge import on_machine_purged, on_client_purged
+from src.utils.scan_recorder import scan_recorder
+from src.utils.rollups import window_start_day, merged_sketch
+from src.utils.hll import RELATIVE_ERROR
+from sqlalchemy import func, desc, case, select, event
+from datetime import date, datetime, timedelta
+import csv
+import io
+import json
+import os
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Overview results per (gym_id, days). Scans flushed by this worker and machine
+# changes evict the gym's entries; the TTL bounds how long another worker's
+# scans can go unseen.
+overview_cache = TTLCache(
+    maxsize=int(os.getenv('ANALYTICS_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('ANALYTICS_CACHE_TTL', 60))
+)
+
+# How unique_users is counted. 'exact' runs COUNT(DISTINCT client_id) over the
+# window's scans. 'approx' merges the per-machine, per-day HyperLogLog sketches
+# in scan_daily_rollups: the estimate is within ~1.6% (one standard error, see
+# src/utils/hll.py) and the window is rounded out to whole UTC days. In approx
+# mode the overview's scan counts also come from the rollups, so its cost follows
+# days x machines instead of scans. ?distinct=exact|approx overrides it per request.
+DISTINCT_MODES = ('exact', 'approx')
+DEFAULT_DISTINCT_MODE = os.getenv('ANALYTICS_DISTINCT_MODE', 'exact')
+
+# Rows fetched per round trip by the scan export's server-side cursor
+SCAN_EXPORT_BATCH_SIZE = int(os.getenv('SCAN_EXPORT_BATCH_SIZE', 2000))
+SCAN_EXPORT_COLUMNS = ['scan_id', 'scan_timestamp', 'machine_id', 'machine_name', 'client_id']
+
+def distinct_mode():
+    mode = request.args.get('distinct', DEFAULT_DISTINCT_MODE)
+    return mode if mode in DISTINCT_MODES else None
+
+def distinct_mode_info(mode):
+    info = {'unique_users_mode': mode}
+    if mode == 'approx':
+        info['unique_users_relative_error'] = round(RELATIVE_ERROR, 4)
+    return info
+
+def approx_unique_users(gym_id, days):
+    sketches = db.session.query(ScanDailyRollup.client_sketch).filter(
+        ScanDailyRollup.gym_id == gym_id,
+        ScanDailyRollup.day >= window_start_day(days),
+        ScanDailyRollup.client_sketch.isnot(None)
+    )
+    return merged_sketch(sketch for (sketch,) in sketches).count()
+
+def approx_unique_users_by_machine(gym_id, days, machine_ids):
+    """{machine_id: estimate} from one query over the machines' sketches in the window."""
+    if not machine_ids:
+        return {}
+    sketches = {}
+    rows = db.session.query(ScanDailyRollup.machine_id, ScanDailyRollup.client_sketch).filter(
+        ScanDailyRollup.gym_id == gym_id,
+        ScanDailyRollup.machine_id.in_(machine_ids),
+        ScanDailyRollup.day >= window_start_day(days),
+        ScanDailyRollup.client_sketch.isnot(None)
+    )
+    for machine_id, sketch_bytes in rows:
+        sketches.setdefault(machine_id, []).append(sketch_bytes)
+    return {machine_id: merged_sketch(rows).count() for machine_id, rows in sketches.items()}
+
+def compute_overview(gym_id, days, mode='exact'):
+    """All overview figures in one statement and one pass over the gym's scans
+    (exact), or over its daily rollups (approx, whole UTC days)."""
+    total_machines = select(func.count(GymMachine.id)).where(
+        GymMachine.gym_id == gym_id
+    ).scalar_subquery()
+    if mode == 'approx':
+        in_window = ScanDailyRollup.day >= window_start_day(days)
+        row = db.session.execute(
+            select(
+                total_machines.label('total_machines'),
+                func.sum(ScanDailyRollup.scan_count).label('total_scans'),
+                func.sum(case((in_window, ScanDailyRollup.scan_count), else_=0)).label('recent_scans')
+            ).where(ScanDailyRollup.gym_id == gym_id)
+        ).one()
+        unique_users = approx_unique_users(gym_id, days)
+    else:
+        in_range = ScanHistory.scan_timestamp >= datetime.utcnow() - timedelta(days=days)
+        row = db.session.execute(
+            select(
+                total_machines.label('total_machines'),
+                func.count(ScanHistory.id).label('total_scans'),
+                func.count(case((in_range, ScanHistory.id))).label('recent_scans'),
+                func.count(func.distinct(case((in_range, ScanHistory.client_id)))).label('unique_users')
+            ).select_from(ScanHistory).join(
+                GymMachine, ScanHistory.machine_id == GymMachine.id
+            ).where(GymMachine.gym_id == gym_id)
+        ).one()
+        unique_users = row.unique_users or 0
+    return {
+        'total_machines': row.total_machines or 0,
+        'total_scans': int(row.total_scans or 0),
+        'recent_scans': int(row.recent_scans or 0),
+        'unique_users': unique_users,
+        **distinct_mode_info(mode)
+    }
+
+def invalidate_gym_analytics(gym_id):
+    overview_cache.invalidate_where(lambda key, value: key[0] == gym_id)
+
+@scan_recorder.on_flush
+def evict_scanned_gyms(scans):
+    gym_ids = {scan['gym_id'] for scan in scans}
+    if None in gym_ids:
+        overview_cache.clear()
+    else:
+        overview_cache.invalidate_where(lambda key, value: key[0] in gym_ids)
+
+@event.listens_for(GymMachine, 'after_insert')
+@event.listens_for(GymMachine, 'after_delete')
+def evict_machine_gym_analytics(mapper, connection, target):
+    invalidate_gym_analytics(target.gym_id)
+
+@on_machine_purged
+@on_client_purged
+def evict_purged_analytics(key):
+    # The purged rows' gyms are not known here; purges are rare
+    overview_cache.clear()
+
 @analytics_bp.route('/analytics/overview', methods=['GET'])
 @token_required('owner')
 def get_analytics_overview(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
         
         # Get date range from query params
         days = request.args.get('days', 30, type=int)
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Total machines
-        total_machines = GymMachine.query.filter_by(gym_id=gym.id).count()
-        
-        # Total scans
-        total_scans = db.session.query(ScanHistory).join(
-            GymMachine, ScanHistory.machine_id == GymMachine.id
-        ).filter(
-            GymMachine.gym_id == gym.id
-        ).count()
+        mode = distinct_mode()
+        if mode is None:
+            return jsonify({'message': 'distinct must be one of: exact, approx'}), 400
         
-        # Scans in date range
-        recent_scans = db.session.query(ScanHistory).join(
-            GymMachine, ScanHistory.machine_id == GymMachine.id
-        ).filter(
-            GymMachine.gym_id == gym.id,
-            ScanHistory.scan_timestamp >= start_date
-        ).count()
-        
-        # Unique users in date range
-        unique_users = db.session.query(func.count(func.distinct(ScanHistory.client_id))).join(
-            GymMachine, ScanHistory.machine_id == GymMachine.id
-        ).filter(
-            GymMachine.gym_id == gym.id,
-            ScanHistory.scan_timestamp >= start_date
-        ).scalar()
+        cache_key = (gym.id, days, mode)
+        overview = overview_cache.get(cache_key)
+        if overview is None:
+            overview = compute_overview(gym.id, days, mode)
+            overview_cache.set(cache_key, overview)
         
         return jsonify({
             'overview': {
-                'total_machines': total_machines,
-                'total_scans': total_scans,
-                'recent_scans': recent_scans,
-                'unique_users': unique_users or 0,
+                **overview,
                 'date_range_days': days
             }
         }), 200
@@ -62,29 +163,27 @@ def get_analytics_overview(current_user):
 @token_required('owner')
 def get_machine_usage(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
         
         # Get date range from query params
         days = request.args.get('days', 30, type=int)
-        start_date = datetime.utcnow() - timedelta(days=days)
+        start_day = window_start_day(days)
         
-        # Machine usage statistics
+        # Machine usage statistics, summed from the daily rollups
         machine_usage = db.session.query(
             GymMachine.id,
             GymMachine.name,
-            func.count(ScanHistory.id).label('scan_count')
+            func.coalesce(func.sum(ScanDailyRollup.scan_count), 0).label('scan_count')
         ).outerjoin(
-            ScanHistory, GymMachine.id == ScanHistory.machine_id
+            ScanDailyRollup, db.and_(
+                ScanDailyRollup.machine_id == GymMachine.id,
+                ScanDailyRollup.day >= start_day
+            )
         ).filter(
             GymMachine.gym_id == gym.id
-        ).filter(
-            db.or_(
-                ScanHistory.scan_timestamp >= start_date,
-                ScanHistory.scan_timestamp.is_(None)
-            )
         ).group_by(
             GymMachine.id, GymMachine.name
         ).order_by(desc('scan_count')).all()
@@ -109,26 +208,25 @@ def get_machine_usage(current_user):
 @token_required('owner')
 def get_daily_scans(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
         
         # Get date range from query params
         days = request.args.get('days', 30, type=int)
-        start_date = datetime.utcnow() - timedelta(days=days)
         
         # Daily scan counts
         daily_scans = db.session.query(
-            func.date(ScanHistory.scan_timestamp).label('scan_date'),
-            func.count(ScanHistory.id).label('scan_count')
-        ).join(
-            GymMachine, ScanHistory.machine_id == GymMachine.id
+            ScanDailyRollup.day.label('scan_date'),
+            func.sum(ScanDailyRollup.scan_count).label('scan_count')
         ).filter(
-            GymMachine.gym_id == gym.id,
-            ScanHistory.scan_timestamp >= start_date
+            ScanDailyRollup.gym_id == gym.id,
+            ScanDailyRollup.day >= window_start_day(days)
         ).group_by(
-            func.date(ScanHistory.scan_timestamp)
+            ScanDailyRollup.day
+        ).having(
+            func.sum(ScanDailyRollup.scan_count) > 0
         ).order_by('scan_date').all()
         
         daily_data = []
@@ -150,45 +248,150 @@ def get_daily_scans(current_user):
 @token_required('owner')
 def get_popular_machines(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
         
         limit = request.args.get('limit', 5, type=int)
         days = request.args.get('days', 30, type=int)
-        start_date = datetime.utcnow() - timedelta(days=days)
+        # Whole UTC days, like the rollups the scan counts come from
+        start_day = window_start_day(days)
+        mode = distinct_mode()
+        if mode is None:
+            return jsonify({'message': 'distinct must be one of: exact, approx'}), 400
         
-        # Most popular machines
+        # Most popular machines: ranked from the rollups; distinct users are then
+        # counted from scan_history for just those machines
         popular_machines = db.session.query(
             GymMachine.id,
             GymMachine.name,
-            func.count(ScanHistory.id).label('scan_count'),
-            func.count(func.distinct(ScanHistory.client_id)).label('unique_users')
+            func.sum(ScanDailyRollup.scan_count).label('scan_count')
         ).join(
-            ScanHistory, GymMachine.id == ScanHistory.machine_id
+            ScanDailyRollup, ScanDailyRollup.machine_id == GymMachine.id
         ).filter(
-            GymMachine.gym_id == gym.id,
-            ScanHistory.scan_timestamp >= start_date
+            ScanDailyRollup.gym_id == gym.id,
+            ScanDailyRollup.day >= start_day
         ).group_by(
             GymMachine.id, GymMachine.name
+        ).having(
+            func.sum(ScanDailyRollup.scan_count) > 0
         ).order_by(desc('scan_count')).limit(limit).all()
         
+        if mode == 'approx':
+            unique_users_by_machine = approx_unique_users_by_machine(
+                gym.id, days, [machine_id for machine_id, _, _ in popular_machines]
+            )
+        elif popular_machines:
+            unique_users_by_machine = dict(db.session.query(
+                ScanHistory.machine_id,
+                func.count(func.distinct(ScanHistory.client_id))
+            ).filter(
+                ScanHistory.machine_id.in_([machine_id for machine_id, _, _ in popular_machines]),
+                ScanHistory.scan_timestamp >= start_day
+            ).group_by(ScanHistory.machine_id).all())
+        else:
+            unique_users_by_machine = {}
+        
         popular_data = []
-        for machine_id, machine_name, scan_count, unique_users in popular_machines:
+        for machine_id, machine_name, scan_count in popular_machines:
             popular_data.append({
                 'machine_id': machine_id,
                 'machine_name': machine_name,
                 'scan_count': scan_count,
-                'unique_users': unique_users
+                'unique_users': unique_users_by_machine.get(machine_id, 0)
             })
         
         return jsonify({
             'popular_machines': popular_data,
             'date_range_days': days,
-            'limit': limit
+            'limit': limit,
+            **distinct_mode_info(mode)
         }), 200
         
     except Exception as e:
         return jsonify({'message': f'Failed to retrieve popular machines: {str(e)}'}), 500
 
+def iter_scan_partitions(gym_id, start_day, end_day):
+    """Yield lists of export rows from a server-side cursor, SCAN_EXPORT_BATCH_SIZE
+    at a time; plain tuples, no ORM objects, so memory stays flat."""
+    query = select(
+        ScanHistory.id,
+        ScanHistory.scan_timestamp,
+        ScanHistory.machine_id,
+        GymMachine.name,
+        ScanHistory.client_id
+    ).join(
+        GymMachine, ScanHistory.machine_id == GymMachine.id
+    ).where(
+        GymMachine.gym_id == gym_id,
+        ScanHistory.scan_timestamp >= start_day,
+        ScanHistory.scan_timestamp < end_day + timedelta(days=1)
+    ).order_by(ScanHistory.scan_timestamp, ScanHistory.id)
+
+    result = db.session.execute(
+        query, execution_options={'stream_results': True, 'yield_per': SCAN_EXPORT_BATCH_SIZE}
+    )
+    try:
+        for rows in result.partitions():
+            yield [
+                (scan_id, scan_timestamp.isoformat() if scan_timestamp else None, machine_id, machine_name, client_id)
+                for scan_id, scan_timestamp, machine_id, machine_name, client_id in rows
+            ]
+    finally:
+        result.close()
+
+def generate_scan_csv(gym_id, start_day, end_day):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SCAN_EXPORT_COLUMNS)
+    for rows in iter_scan_partitions(gym_id, start_day, end_day):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def generate_scan_ndjson(gym_id, start_day, end_day):
+    for rows in iter_scan_partitions(gym_id, start_day, end_day):
+        yield ''.join(json.dumps(dict(zip(SCAN_EXPORT_COLUMNS, row))) + '\n' for row in rows)
+
+@analytics_bp.route('/analytics/scans/export', methods=['GET'])
+@token_required('owner')
+def export_scans(current_user):
+    """Raw scan history of the owner's gym as CSV or NDJSON.
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (UTC, inclusive; defaults to the last 30 days)
+    and ?format=csv|ndjson.
+    """
+    try:
+        gym = get_owner_gym(current_user)
+        
+        if not gym:
+            return jsonify({'message': 'No gym found for this owner'}), 404
+        
+        try:
+            end_day = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+            start_day = date.fromisoformat(request.args['start']) if request.args.get('start') else end_day - timedelta(days=30)
+        except ValueError:
+            return jsonify({'message': 'start and end must be dates in YYYY-MM-DD format'}), 400
+        if start_day > end_day:
+            return jsonify({'message': 'start must not be after end'}), 400
+        
+        output_format = (request.args.get('format') or 'csv').lower()
+        if output_format == 'csv':
+            body, mimetype = generate_scan_csv(gym.id, start_day, end_day), 'text/csv'
+        elif output_format == 'ndjson':
+            body, mimetype = generate_scan_ndjson(gym.id, start_day, end_day), 'application/x-ndjson'
+        else:
+            return jsonify({'message': 'format must be csv or ndjson'}), 400
+        
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename=gym_{gym.id}_scans_{start_day.isoformat()}_{end_day.isoformat()}.{output_format}'
+        )
+        return response
+        
+    except Exception as e:
+        return jsonify({'message': f'Failed to export scans: {str(e)}'}), 500
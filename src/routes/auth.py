@@ -1,12 +1,137 @@
 from flask import Blueprint, request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 from jose import jwt as pyjwt
 from datetime import datetime, timedelta
 from functools import wraps
-from src.models.gym import db, GymOwner, GymClient
+from sqlalchemy import delete, event, inspect, select, update
+from sqlalchemy.orm import make_transient_to_detached
+from src.models.gym import db, Gym, GymOwner, GymClient, RefreshToken
+from src.utils.cache import TTLCache
+from src.utils.passwords import hash_password, verify_password, PoolSaturated, RETRY_AFTER_SECONDS
+from src.utils.purge import on_client_purged
+import hashlib
+import os
+import secrets
+import time
 
 auth_bp = Blueprint('auth', __name__)
 
+PRINCIPAL_MODELS = {'owner': GymOwner, 'client': GymClient}
+
+# Column snapshots of recently authenticated users, keyed by (user_type, user_id).
+# Password hashes are never cached; they stay expired on the attached instance.
+principal_cache = TTLCache(
+    maxsize=int(os.getenv('PRINCIPAL_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('PRINCIPAL_CACHE_TTL', 300))
+)
+
+def load_principal(user_type, user_id):
+    model = PRINCIPAL_MODELS.get(user_type)
+    if model is None:
+        return None
+
+    key = (user_type, user_id)
+    columns = principal_cache.get(key)
+    if columns is None:
+        user = model.query.filter_by(id=user_id).first()
+        if user:
+            principal_cache.set(key, {
+                attr.key: getattr(user, attr.key)
+                for attr in inspect(model).column_attrs
+                if attr.key != 'password_hash'
+            })
+        return user
+
+    # Attach the snapshot to the current session without emitting a SELECT
+    user = model(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+@event.listens_for(GymOwner, 'after_update')
+@event.listens_for(GymOwner, 'after_delete')
+def evict_owner_principal(mapper, connection, target):
+    principal_cache.invalidate(('owner', target.id))
+
+# Short-lived access tokens authorize API calls; long-lived refresh tokens are only
+# accepted by /refresh. Tokens minted before this split carry no token_use and are
+# treated as access tokens until they expire.
+# Refresh tokens carry an id (jti) recorded in refresh_tokens and the user's
+# token_version. Each one is accepted once and replaced by a new one; presenting
+# a used one again revokes all of the user's refresh tokens, as does a password change.
+ACCESS_TOKEN_TTL = timedelta(minutes=int(os.getenv('ACCESS_TOKEN_TTL_MINUTES', 15)))
+REFRESH_TOKEN_TTL = timedelta(days=int(os.getenv('REFRESH_TOKEN_TTL_DAYS', 30)))
+
+# Claims of tokens that already passed signature and expiry checks, keyed by the
+# token's SHA-256 digest and kept no longer than the token itself is valid.
+verified_token_cache = TTLCache(maxsize=int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', 4096)), ttl=None)
+
+def decode_token(token):
+    digest = hashlib.sha256(token.encode()).digest()
+    data = verified_token_cache.get(digest)
+    if data is None:
+        data = pyjwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        remaining = data.get('exp', 0) - time.time()
+        if remaining > 0:
+            verified_token_cache.set(digest, data, ttl=remaining)
+    return data
+
+def issue_token(user, user_type):
+    now = datetime.utcnow()
+    payload = {
+        'user_id': user.id,
+        'user_type': user_type,
+        'token_use': 'access',
+        'iat': now,
+        'exp': now + ACCESS_TOKEN_TTL
+    }
+    return pyjwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+def issue_refresh_token(user, user_type):
+    """Record a new refresh token for user and return it; commits the session."""
+    now = datetime.utcnow()
+    jti = secrets.token_urlsafe(24)
+    token_version = user.token_version or 0
+    db.session.execute(delete(RefreshToken).where(
+        RefreshToken.user_type == user_type,
+        RefreshToken.user_id == user.id,
+        RefreshToken.expires_at < now
+    ))
+    db.session.add(RefreshToken(jti=jti, user_type=user_type, user_id=user.id, expires_at=now + REFRESH_TOKEN_TTL))
+    db.session.commit()
+    return pyjwt.encode({
+        'user_id': user.id,
+        'user_type': user_type,
+        'token_use': 'refresh',
+        'jti': jti,
+        'tv': token_version,
+        'iat': now,
+        'exp': now + REFRESH_TOKEN_TTL
+    }, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+def revoke_refresh_tokens(user):
+    user.token_version = (user.token_version or 0) + 1
+    db.session.commit()
+
+@event.listens_for(GymOwner, 'before_update')
+@event.listens_for(GymClient, 'before_update')
+def revoke_refresh_tokens_on_password_change(mapper, connection, target):
+    if inspect(target).attrs.password_hash.history.has_changes():
+        target.token_version = (target.token_version or 0) + 1
+
+def is_access_token(data):
+    return data.get('token_use', 'access') == 'access'
+
+def get_owner_gym(current_user):
+    return Gym.query.filter_by(owner_id=current_user.id).first()
+
+@event.listens_for(GymClient, 'after_update')
+@event.listens_for(GymClient, 'after_delete')
+def evict_client_principal(mapper, connection, target):
+    principal_cache.invalidate(('client', target.id))
+
+@on_client_purged
+def evict_purged_client_principal(client_id):
+    principal_cache.invalidate(('client', client_id))
+
 def token_required(user_type='both'):
     def decorator(f):
         @wraps(f)
@@ -24,12 +149,14 @@ def token_required(user_type='both'):
                 return jsonify({'message': 'Token is missing'}), 401
             
             try:
-                data = pyjwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+                data = decode_token(token)
+                if not is_access_token(data):
+                    return jsonify({'message': 'Token is invalid'}), 401
                 
                 if user_type == 'owner' or (user_type == 'both' and data.get('user_type') == 'owner'):
-                    current_user = GymOwner.query.filter_by(id=data['user_id']).first()
+                    current_user = load_principal('owner', data['user_id'])
                 elif user_type == 'client' or (user_type == 'both' and data.get('user_type') == 'client'):
-                    current_user = GymClient.query.filter_by(id=data['user_id']).first()
+                    current_user = load_principal('client', data['user_id'])
                 else:
                     return jsonify({'message': 'Invalid user type'}), 401
                 
@@ -45,6 +172,11 @@ def token_required(user_type='both'):
         return decorated
     return decorator
 
+def server_busy():
+    response = jsonify({'message': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response, 503
+
 @auth_bp.route('/register/owner', methods=['POST'])
 def register_owner():
     try:
@@ -65,7 +197,7 @@ def register_owner():
             return jsonify({'message': 'Email already exists'}), 400
         
         # Create new gym owner
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         new_owner = GymOwner(
             username=data['username'],
             email=data['email'],
@@ -82,6 +214,9 @@ def register_owner():
             'user': new_owner.to_dict()
         }), 201
         
+    except PoolSaturated:
+        db.session.rollback()
+        return server_busy()
     except Exception as e:
         db.session.rollback()
         print("Registration failed:", str(e))  # Debug log
@@ -103,7 +238,7 @@ def register_client():
             return jsonify({'message': 'Email already exists'}), 400
         
         # Create new gym client
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         new_client = GymClient(
             username=data['username'],
             email=data['email'],
@@ -118,6 +253,9 @@ def register_client():
             'user': new_client.to_dict()
         }), 201
         
+    except PoolSaturated:
+        db.session.rollback()
+        return server_busy()
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Registration failed: {str(e)}'}), 500
@@ -132,22 +270,25 @@ def login_owner():
         
         owner = GymOwner.query.filter_by(username=data['username']).first()
         
-        if owner and check_password_hash(owner.password_hash, data['password']):
-            token = pyjwt.encode({
-                'user_id': owner.id,
-                'user_type': 'owner',
-                'exp': datetime.utcnow() + timedelta(hours=24)
-            }, current_app.config['SECRET_KEY'], algorithm='HS256')
+        if owner and verify_password(owner.password_hash, data['password']):
+            token = issue_token(owner, 'owner')
+            refresh = issue_refresh_token(owner, 'owner')
             
             return jsonify({
                 'message': 'Login successful',
                 'token': token,
+                'refresh_token': refresh,
+                'expires_in': int(ACCESS_TOKEN_TTL.total_seconds()),
                 'user': owner.to_dict()
             }), 200
         
         return jsonify({'message': 'Invalid credentials'}), 401
         
+    except PoolSaturated:
+        db.session.rollback()
+        return server_busy()
     except Exception as e:
+        db.session.rollback()
         return jsonify({'message': f'Login failed: {str(e)}'}), 500
 
 @auth_bp.route('/login/client', methods=['POST'])
@@ -160,24 +301,93 @@ def login_client():
         
         client = GymClient.query.filter_by(username=data['username']).first()
         
-        if client and check_password_hash(client.password_hash, data['password']):
-            token = pyjwt.encode({
-                'user_id': client.id,
-                'user_type': 'client',
-                'exp': datetime.utcnow() + timedelta(hours=24)
-            }, current_app.config['SECRET_KEY'], algorithm='HS256')
+        if client and verify_password(client.password_hash, data['password']):
+            token = issue_token(client, 'client')
+            refresh = issue_refresh_token(client, 'client')
             
             return jsonify({
                 'message': 'Login successful',
                 'token': token,
+                'refresh_token': refresh,
+                'expires_in': int(ACCESS_TOKEN_TTL.total_seconds()),
                 'user': client.to_dict()
             }), 200
         
         return jsonify({'message': 'Invalid credentials'}), 401
         
+    except PoolSaturated:
+        db.session.rollback()
+        return server_busy()
     except Exception as e:
+        db.session.rollback()
         return jsonify({'message': f'Login failed: {str(e)}'}), 500
 
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh_token():
+    try:
+        data = request.get_json(silent=True) or {}
+        token = data.get('refresh_token')
+        
+        if not token and 'Authorization' in request.headers:
+            try:
+                token = request.headers['Authorization'].split(" ")[1]  # Bearer <refresh token>
+            except IndexError:
+                return jsonify({'message': 'Token format invalid'}), 401
+        
+        if not token:
+            return jsonify({'message': 'Refresh token is missing'}), 401
+        
+        claims = decode_token(token)
+        if claims.get('token_use') != 'refresh' or not claims.get('jti'):
+            return jsonify({'message': 'Refresh token is invalid'}), 401
+        
+        model = PRINCIPAL_MODELS.get(claims.get('user_type'))
+        if model is None:
+            return jsonify({'message': 'Refresh token is invalid'}), 401
+        
+        # Not load_principal: token_version must come from the database, not a worker's cache
+        user = model.query.filter_by(id=claims.get('user_id')).first()
+        if not user:
+            return jsonify({'message': 'User not found'}), 401
+        
+        if claims.get('tv') != (user.token_version or 0):
+            return jsonify({'message': 'Refresh token has been revoked'}), 401
+        
+        # Claim the token atomically, so two concurrent refreshes cannot both use it
+        now = datetime.utcnow()
+        claimed = db.session.execute(update(RefreshToken).where(
+            RefreshToken.jti == claims['jti'],
+            RefreshToken.user_type == claims['user_type'],
+            RefreshToken.user_id == user.id,
+            RefreshToken.used_at.is_(None),
+            RefreshToken.expires_at > now
+        ).values(used_at=now)).rowcount
+        if claimed != 1:
+            db.session.rollback()
+            reused = db.session.scalar(select(RefreshToken.jti).where(
+                RefreshToken.jti == claims['jti'], RefreshToken.used_at.isnot(None)
+            ))
+            if reused:
+                # A rotated token came back: assume it leaked and revoke the whole family
+                print(f"Refresh token reuse for {claims['user_type']} {user.id}; revoking all refresh tokens")
+                revoke_refresh_tokens(user)
+            return jsonify({'message': 'Refresh token has been revoked'}), 401
+        
+        user_type = claims['user_type']
+        return jsonify({
+            'token': issue_token(user, user_type),
+            'refresh_token': issue_refresh_token(user, user_type),
+            'expires_in': int(ACCESS_TOKEN_TTL.total_seconds())
+        }), 200
+        
+    except pyjwt.ExpiredSignatureError:
+        return jsonify({'message': 'Refresh token has expired'}), 401
+    except pyjwt.InvalidTokenError:
+        return jsonify({'message': 'Refresh token is invalid'}), 401
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Token refresh failed: {str(e)}'}), 500
+
 @auth_bp.route('/verify-token', methods=['POST'])
 def verify_token():
     try:
@@ -193,12 +403,12 @@ def verify_token():
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         
-        data = pyjwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        data = decode_token(token)
+        if not is_access_token(data):
+            return jsonify({'valid': False, 'message': 'Token is invalid'}), 401
         
-        if data.get('user_type') == 'owner':
-            user = GymOwner.query.filter_by(id=data['user_id']).first()
-        elif data.get('user_type') == 'client':
-            user = GymClient.query.filter_by(id=data['user_id']).first()
+        if data.get('user_type') in PRINCIPAL_MODELS:
+            user = load_principal(data['user_type'], data['user_id'])
         else:
             return jsonify({'message': 'Invalid user type'}), 401
         
@@ -1,11 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from src.models.gym import db, Gym, GymMachine, MultilingualContent
-from src.routes.auth import token_required
-import os
-from werkzeug.utils import secure_filename
+from src.routes.auth import token_required, get_owner_gym
+from sqlalchemy.orm import load_only, selectinload
+from src.utils.gym_logos import schedule_logo_refresh
+from src.utils.media_store import store_video_stream, UploadError
+from src.utils.scan_cards import invalidate_machine_card, invalidate_gym_cards
+from src.utils.purge import purge_machine, schedule_purge
+from src.utils.multilingual import normalize_translations, sync_translations, translations_changed
 
 gym_bp = Blueprint('gym', __name__)
 
+MAX_MACHINES_PAGE_SIZE = 200
+
 @gym_bp.route('/gym', methods=['POST'])
 @token_required('owner')
 def create_gym(current_user):
@@ -28,6 +34,10 @@ def create_gym(current_user):
         db.session.add(new_gym)
         db.session.commit()
 
+        # Fetch and preprocess the logo off the request thread for QR rendering
+        if new_gym.logo_url:
+            schedule_logo_refresh(new_gym.id, new_gym.logo_url, force=True)
+
         return jsonify({
             'message': 'Gym created successfully',
             'gym': new_gym.to_dict()
@@ -42,7 +52,7 @@ def create_gym(current_user):
 @token_required('owner')
 def get_gym(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
         return jsonify({'gym': gym.to_dict()}), 200
@@ -55,7 +65,7 @@ def get_gym(current_user):
 def update_gym(current_user):
     try:
         data = request.get_json()
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
 
@@ -67,6 +77,10 @@ def update_gym(current_user):
             gym.contact_info = data['contact_info']
 
         db.session.commit()
+        invalidate_gym_cards(gym.id)
+
+        if 'logo_url' in data:
+            schedule_logo_refresh(gym.id, gym.logo_url, force=True)
 
         return jsonify({
             'message': 'Gym updated successfully',
@@ -81,7 +95,7 @@ def update_gym(current_user):
 @token_required('owner')
 def create_machine(current_user):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'You must create a gym first'}), 400
 
@@ -113,18 +127,17 @@ def create_machine(current_user):
             import json
             try:
                 multilingual_data = json.loads(multilingual_data)
-                for content in multilingual_data:
-                    if content.get('language_code'):
-                        db.session.add(MultilingualContent(
-                            machine_id=new_machine.id,
-                            language_code=content['language_code'],
-                            instruction_text=content.get('instruction_text'),
-                            safety_text=content.get('safety_text')
-                        ))
+                for language_code, values in normalize_translations(multilingual_data).items():
+                    db.session.add(MultilingualContent(
+                        machine_id=new_machine.id,
+                        language_code=language_code,
+                        **values
+                    ))
             except Exception as e:
                 print("Invalid multilingual JSON:", e)
 
         db.session.commit()
+        invalidate_machine_card(new_machine.id)
 
         return jsonify({
             'message': 'Machine created successfully',
@@ -140,7 +153,7 @@ def create_machine(current_user):
 @token_required('owner')
 def update_machine(current_user, machine_id):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
 
@@ -156,11 +169,11 @@ def update_machine(current_user, machine_id):
 
         video = request.files.get('video')
         if video:
-            filename = secure_filename(video.filename)
-            upload_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-            os.makedirs(upload_folder, exist_ok=True)
-            local_video_path = os.path.join("uploads", filename).replace("\\", "/")
-            video.save(os.path.join(upload_folder, filename))
+            # Stored by content hash: identical videos share one file, names never collide
+            try:
+                local_video_path, _ = store_video_stream(video.stream, video.filename)
+            except UploadError as e:
+                return jsonify({'message': str(e)}), e.status
 
         if name:
             machine.name = name
@@ -173,23 +186,30 @@ def update_machine(current_user, machine_id):
         if local_video_path:
             machine.local_video_path = local_video_path
 
+        machine_changed = db.session.is_modified(machine)
+
+        # Diffed against the stored rows: only languages whose text changed are written.
+        # multilingual_mode=merge leaves languages that are not in the payload alone.
+        multilingual_changes = None
         multilingual_data = request.form.get('multilingual_content')
         if multilingual_data:
             import json
-            MultilingualContent.query.filter_by(machine_id=machine.id).delete()
-            multilingual_data = json.loads(multilingual_data)
-            for content in multilingual_data:
-                if content.get('language_code'):
-                    db.session.add(MultilingualContent(
-                        machine_id=machine.id,
-                        language_code=content['language_code'],
-                        instruction_text=content.get('instruction_text'),
-                        safety_text=content.get('safety_text')
-                    ))
+            multilingual_changes = sync_translations(
+                machine.id,
+                json.loads(multilingual_data),
+                replace=request.form.get('multilingual_mode', 'replace') != 'merge'
+            )
+            machine_changed = machine_changed or translations_changed(multilingual_changes)
 
-        db.session.commit()
+        if machine_changed:
+            db.session.commit()
+            invalidate_machine_card(machine.id)
 
-        return jsonify({'message': 'Machine updated successfully', 'machine': machine.to_dict()}), 200
+        return jsonify({
+            'message': 'Machine updated successfully',
+            'machine': machine.to_dict(),
+            'multilingual_changes': multilingual_changes
+        }), 200
 
     except Exception as e:
         db.session.rollback()
@@ -199,20 +219,63 @@ def update_machine(current_user, machine_id):
 @gym_bp.route('/gym/machines', methods=['GET'])
 @token_required('owner')
 def get_machines(current_user):
+    """List the gym's machines with their translations in two queries.
+
+    Optional: ?fields=id,name,... to project columns (add multilingual_content to
+    include translations), ?limit=N&cursor=<last id> for keyset pagination.
+    """
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
 
-        machines = GymMachine.query.filter_by(gym_id=gym.id).all()
+        fields = list(GymMachine.SERIALIZED_FIELDS)
+        include_multilingual = True
+        if request.args.get('fields'):
+            fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+            include_multilingual = 'multilingual_content' in fields
+            fields = [f for f in fields if f != 'multilingual_content']
+            unknown = set(fields) - set(GymMachine.SERIALIZED_FIELDS)
+            if unknown:
+                return jsonify({'message': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+            # Translations alone still need to say which machine they belong to
+            fields = fields or ['id']
+
+        query = GymMachine.query.filter_by(gym_id=gym.id).order_by(GymMachine.id).options(
+            load_only(*[getattr(GymMachine, f) for f in set(fields) | {'id'}])
+        )
+        if include_multilingual:
+            query = query.options(selectinload(GymMachine.multilingual_content))
+
+        cursor = request.args.get('cursor', type=int)
+        if cursor:
+            query = query.filter(GymMachine.id > cursor)
+
+        limit = request.args.get('limit', type=int)
+        if limit:
+            limit = max(1, min(limit, MAX_MACHINES_PAGE_SIZE))
+            machines = query.limit(limit + 1).all()
+            has_more = len(machines) > limit
+            machines = machines[:limit]
+        else:
+            machines = query.all()
+            has_more = False
+
         result = []
         for machine in machines:
-            machine_dict = machine.to_dict()
-            multilingual = MultilingualContent.query.filter_by(machine_id=machine.id).all()
-            machine_dict['multilingual_content'] = [m.to_dict() for m in multilingual]
+            machine_dict = machine.to_dict(fields)
+            if include_multilingual:
+                machine_dict['multilingual_content'] = [m.to_dict() for m in machine.multilingual_content]
             result.append(machine_dict)
 
-        return jsonify({'machines': result}), 200
+        response = {'machines': result}
+        if limit:
+            response['pagination'] = {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': machines[-1].id if has_more else None
+            }
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({'message': f'Failed to retrieve machines: {str(e)}'}), 500
@@ -222,18 +285,21 @@ def get_machines(current_user):
 @token_required('owner')
 def delete_machine(current_user, machine_id):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
 
-        machine = GymMachine.query.filter_by(id=machine_id, gym_id=gym.id).first()
-        if not machine:
+        machine_exists = db.session.query(GymMachine.id).filter_by(id=machine_id, gym_id=gym.id).first()
+        if not machine_exists:
             return jsonify({'message': 'Machine not found'}), 404
 
-        db.session.delete(machine)
-        db.session.commit()
+        # Busy machines carry a lot of scan history; ?background=1 answers right away
+        if request.args.get('background') in ('1', 'true'):
+            schedule_purge(current_app._get_current_object(), purge_machine, machine_id)
+            return jsonify({'message': 'Machine deletion started'}), 202
 
-        return jsonify({'message': 'Machine deleted successfully'}), 200
+        deleted = purge_machine(machine_id)
+        return jsonify({'message': 'Machine deleted successfully', 'deleted': deleted}), 200
 
     except Exception as e:
         db.session.rollback()
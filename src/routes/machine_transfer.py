@@ -0,0 +1,237 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from src.models.gym import db, GymMachine, MultilingualContent
+from src.routes.auth import token_required, get_owner_gym
+from src.routes.analytics import invalidate_gym_analytics
+from sqlalchemy import insert
+from sqlalchemy.orm import selectinload
+import csv
+import io
+import json
+
+machine_transfer_bp = Blueprint('machine_transfer', __name__)
+
+EXPORT_BATCH_SIZE = 500
+IMPORT_CHUNK_SIZE = 200
+MAX_REPORTED_ERRORS = 1000
+
+CSV_COLUMNS = list(GymMachine.SERIALIZED_FIELDS) + ['multilingual_content']
+IMPORT_FIELDS = {
+    'name': 100,
+    'how_to_use_video_url': 255,
+    'local_video_path': 255,
+    'safety_tips': None,
+    'usage_guide': None
+}
+MULTILINGUAL_FIELDS = ('language_code', 'instruction_text', 'safety_text')
+
+def transfer_format(default='ndjson'):
+    requested = request.args.get('format')
+    if not requested:
+        content_type = request.mimetype or ''
+        requested = 'csv' if 'csv' in content_type else default
+    return requested.lower()
+
+def iter_machine_batches(gym_id):
+    # Keyset pages keep memory flat however many machines the gym has
+    last_id = 0
+    while True:
+        machines = GymMachine.query.filter(
+            GymMachine.gym_id == gym_id, GymMachine.id > last_id
+        ).order_by(GymMachine.id).options(
+            selectinload(GymMachine.multilingual_content)
+        ).limit(EXPORT_BATCH_SIZE).all()
+        if not machines:
+            return
+        yield machines
+        last_id = machines[-1].id
+        db.session.expunge_all()
+
+def export_record(machine):
+    record = machine.to_dict()
+    record['multilingual_content'] = [
+        {field: getattr(content, field) for field in MULTILINGUAL_FIELDS}
+        for content in machine.multilingual_content
+    ]
+    return record
+
+def generate_ndjson(gym_id):
+    for machines in iter_machine_batches(gym_id):
+        yield ''.join(json.dumps(export_record(machine)) + '\n' for machine in machines)
+
+def generate_csv(gym_id):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for machines in iter_machine_batches(gym_id):
+        for machine in machines:
+            record = export_record(machine)
+            record['multilingual_content'] = json.dumps(record['multilingual_content'])
+            writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@machine_transfer_bp.route('/gym/machines/export', methods=['GET'])
+@token_required('owner')
+def export_machines(current_user):
+    try:
+        gym = get_owner_gym(current_user)
+        if not gym:
+            return jsonify({'message': 'No gym found for this owner'}), 404
+
+        output_format = transfer_format()
+        if output_format == 'csv':
+            body, mimetype = generate_csv(gym.id), 'text/csv'
+        elif output_format == 'ndjson':
+            body, mimetype = generate_ndjson(gym.id), 'application/x-ndjson'
+        else:
+            return jsonify({'message': 'format must be ndjson or csv'}), 400
+
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=gym_{gym.id}_machines.{output_format}'
+        return response
+
+    except Exception as e:
+        return jsonify({'message': f'Failed to export machines: {str(e)}'}), 500
+
+def iter_import_records(stream, input_format):
+    """Yield (row number, record or None, parse error or None) from the request body."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if input_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, row, None
+        return
+
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, 'Each line must be a JSON object'
+            continue
+        yield row_number, record, None
+
+def validate_import_record(record):
+    """Return (machine values, translations, errors) for one imported row."""
+    errors = []
+    values = {}
+    for field, max_length in IMPORT_FIELDS.items():
+        value = record.get(field)
+        if value in ('', None):
+            value = None
+        elif not isinstance(value, str):
+            errors.append(f'{field} must be a string')
+            continue
+        elif max_length and len(value) > max_length:
+            errors.append(f'{field} must be at most {max_length} characters')
+            continue
+        values[field] = value
+    if not values.get('name'):
+        errors.append('name is required')
+
+    translations = {}
+    multilingual = record.get('multilingual_content') or []
+    if isinstance(multilingual, str):
+        try:
+            multilingual = json.loads(multilingual)
+        except ValueError:
+            errors.append('multilingual_content is not valid JSON')
+            multilingual = []
+    if not isinstance(multilingual, list):
+        errors.append('multilingual_content must be a list')
+        multilingual = []
+    for content in multilingual:
+        language_code = content.get('language_code') if isinstance(content, dict) else None
+        if not isinstance(language_code, str) or not language_code or len(language_code) > 10:
+            errors.append('each multilingual_content entry needs a language_code of at most 10 characters')
+            continue
+        # Later entries for the same language win
+        translations[language_code] = {
+            'language_code': language_code,
+            'instruction_text': content.get('instruction_text'),
+            'safety_text': content.get('safety_text')
+        }
+    return values, list(translations.values()), errors
+
+def insert_machine_chunk(gym_id, chunk):
+    machine_ids = db.session.scalars(
+        insert(GymMachine).returning(GymMachine.id, sort_by_parameter_order=True),
+        [dict(values, gym_id=gym_id) for values, _ in chunk]
+    ).all()
+    translation_rows = [
+        dict(translation, machine_id=machine_id)
+        for machine_id, (_, translations) in zip(machine_ids, chunk)
+        for translation in translations
+    ]
+    if translation_rows:
+        db.session.execute(insert(MultilingualContent), translation_rows)
+
+@machine_transfer_bp.route('/gym/machines/import', methods=['POST'])
+@token_required('owner')
+def import_machines(current_user):
+    """Import machines from an NDJSON or CSV body in one transaction.
+
+    Valid rows are inserted in chunks and invalid ones reported by row number;
+    ?strict=1 rolls everything back if any row is invalid, ?dry_run=1 always does.
+    """
+    try:
+        gym = get_owner_gym(current_user)
+        if not gym:
+            return jsonify({'message': 'You must create a gym first'}), 400
+
+        input_format = transfer_format()
+        if input_format not in ('ndjson', 'csv'):
+            return jsonify({'message': 'format must be ndjson or csv'}), 400
+        strict = request.args.get('strict') in ('1', 'true')
+        dry_run = request.args.get('dry_run') in ('1', 'true')
+
+        imported = 0
+        error_count = 0
+        errors = []
+        chunk = []
+        for row_number, record, parse_error in iter_import_records(request.stream, input_format):
+            row_errors = [parse_error] if parse_error else []
+            if record is not None:
+                values, translations, row_errors = validate_import_record(record)
+            if row_errors:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'row': row_number, 'errors': row_errors})
+                continue
+
+            chunk.append((values, translations))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                insert_machine_chunk(gym.id, chunk)
+                imported += len(chunk)
+                chunk = []
+
+        if chunk:
+            insert_machine_chunk(gym.id, chunk)
+            imported += len(chunk)
+
+        committed = not dry_run and not (strict and error_count)
+        if committed:
+            db.session.commit()
+            # Core inserts skip the ORM events that normally evict the overview
+            invalidate_gym_analytics(gym.id)
+        else:
+            db.session.rollback()
+
+        return jsonify({
+            'message': 'Import completed' if committed else 'Import rolled back',
+            'imported': imported if committed else 0,
+            'valid_rows': imported,
+            'error_count': error_count,
+            'errors': errors,
+            'dry_run': dry_run
+        }), 200 if committed or dry_run else 422
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to import machines: {str(e)}'}), 500
@@ -1,31 +1,208 @@
-from flask import Blueprint, request, jsonify, send_file
-import qrcode
+from flask import Blueprint, request, jsonify, send_file, Response, current_app
 import io
 import base64
-import secrets
 import json
+import math
 import os
+import threading
+import time
 from cryptography.fernet import Fernet
-from src.models.gym import db, QRCode, GymMachine, Gym, ScanHistory
-from src.routes.auth import token_required
-from PIL import Image, ImageDraw, ImageFont
-import requests
+from src.models.gym import db, QRCode, GymMachine, Gym
+from src.routes.auth import token_required, get_owner_gym
+from src.utils.qr_render import render_key, get_or_render_qr, variant_style, prerender_qr_variants, QR_SIZES, QR_FORMATS
+from src.utils.gym_logos import logo_digest, load_gym_logo_bytes
+from src.utils.qr_sheets import iter_rendered_qr_codes, iter_rendered_qr_codes_in_order, stream_qr_zip, stream_qr_pdf
+from src.utils.bloom import BloomFilter
+from src.utils.cache import TTLCache
+from src.utils.rate_limit import SharedTokenBucket, client_ip
+from src.utils.scan_recorder import scan_recorder
+from src.utils.scan_cards import get_scan_card
+from src.utils.purge import on_machine_purged
+from src.utils.qr_tokens import issue_signed_token, verify_signed_token, is_signed_token, is_legacy_token, InvalidQRToken
+from sqlalchemy import event, insert
 
 qr_bp = Blueprint('qr', __name__)
 
+BULK_INSERT_CHUNK = 500
+
+# Per-client-IP budget for the unauthenticated validate endpoint, shared by all workers
+validate_limiter = SharedTokenBucket(
+    'qr-validate',
+    rate=float(os.getenv('QR_VALIDATE_RATE', 5)),
+    burst=float(os.getenv('QR_VALIDATE_BURST', 20))
+)
+
 def get_cipher_suite():
     encryption_key = os.getenv('QR_ENCRYPTION_KEY')
     if not encryption_key:
         raise RuntimeError("QR_ENCRYPTION_KEY environment variable not set")
     return Fernet(encryption_key.encode())
 
+class InvalidQRPayload(Exception):
+    def __init__(self, reason, detail=None):
+        super().__init__(detail or reason)
+        self.reason = reason  # 'platform' or 'data'
+
+# Verified payloads of stored QR codes, keyed by token. Payloads never change for
+# a token, so entries only go away on delete (or TTL, for deletes in other workers).
+qr_payload_cache = TTLCache(
+    maxsize=int(os.getenv('QR_PAYLOAD_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('QR_PAYLOAD_CACHE_TTL', 600))
+)
+
+def lookup_qr_payload(token):
+    """Return {'machine_id', 'gym_id'} for a known token, or None if unknown.
+
+    Signed tokens are checked against their signature first, then must still
+    belong to a stored QR code, so deleted or regenerated codes stop working.
+    Legacy opaque tokens are looked up and their stored payload decrypted;
+    anything else is rejected without a query. Raises InvalidQRPayload when
+    stored data does not decrypt or is not ours.
+    """
+    if is_signed_token(token):
+        try:
+            payload = verify_signed_token(token)
+        except InvalidQRToken:
+            return None
+        return payload if signed_token_exists(token, payload) else None
+    if not is_legacy_token(token):
+        return None
+    
+    payload = qr_payload_cache.get(token)
+    if payload is not None:
+        return payload
+    
+    if not legacy_token_known(token):
+        return None
+    
+    qr_code_record = QRCode.query.filter_by(token=token).first()
+    if not qr_code_record:
+        return None
+    
+    try:
+        encrypted_data = base64.b64decode(qr_code_record.qr_code_data.encode())
+        decrypted_data = get_cipher_suite().decrypt(encrypted_data)
+        qr_data = json.loads(decrypted_data.decode())
+    except Exception as ex:
+        raise InvalidQRPayload('data', f'QR code decryption error for token {token}: {ex}')
+    
+    if qr_data.get('platform') != 'fitcode':
+        raise InvalidQRPayload('platform', f"QR code platform mismatch: {qr_data.get('platform')}")
+    
+    payload = {'machine_id': qr_code_record.machine_id, 'gym_id': qr_data.get('gym_id')}
+    qr_payload_cache.set(token, payload)
+    return payload
+
+def signed_token_exists(token, payload):
+    """Existence check for a verified signed token; positive answers share
+    qr_payload_cache with legacy payloads and go away with it on delete."""
+    if qr_payload_cache.get(token) is not None:
+        return True
+    exists = db.session.query(QRCode.id).filter_by(token=token, machine_id=payload['machine_id']).first() is not None
+    if exists:
+        qr_payload_cache.set(token, payload)
+    return exists
+
+# Bloom filter over legacy opaque tokens, so unknown ones are turned away without a
+# query. New tokens are signed and never enter the filter; the legacy set therefore
+# only shrinks, and a worker's filter cannot miss a token another worker created.
+# A filter built before a delete is still a superset, so it keeps serving while a
+# background thread rebuilds it (after deletes and every LEGACY_TOKEN_FILTER_TTL
+# seconds); until the first build finishes every legacy token goes to the database.
+LEGACY_TOKEN_FILTER_TTL = int(os.getenv('LEGACY_TOKEN_FILTER_TTL', 3600))
+legacy_token_filter = {'bloom': None, 'built_at': 0.0, 'stale': False, 'rebuilding': False}
+_legacy_filter_lock = threading.Lock()
+
+def rebuild_legacy_token_filter():
+    legacy_token_filter['stale'] = False
+    tokens = [token for (token,) in db.session.query(QRCode.token).filter(
+        ~QRCode.token.like('fc1.%')
+    ).yield_per(5000) if is_legacy_token(token)]
+    
+    bloom = BloomFilter(capacity=max(len(tokens) * 2, 1024))
+    for token in tokens:
+        bloom.add(token)
+    legacy_token_filter.update(bloom=bloom, built_at=time.time())
+    return bloom
+
+def _rebuild_legacy_token_filter_in_background(app):
+    with app.app_context():
+        try:
+            rebuild_legacy_token_filter()
+        except Exception as e:
+            print(f"Legacy token filter rebuild failed: {e}")
+        finally:
+            legacy_token_filter['rebuilding'] = False
+            db.session.remove()
+
+def schedule_legacy_token_filter_rebuild():
+    with _legacy_filter_lock:
+        if legacy_token_filter['rebuilding']:
+            return
+        legacy_token_filter['rebuilding'] = True
+    threading.Thread(
+        target=_rebuild_legacy_token_filter_in_background,
+        args=(current_app._get_current_object(),),
+        name='legacy-token-filter',
+        daemon=True
+    ).start()
+
+def legacy_token_known(token):
+    """False only when token is certainly not a stored legacy token."""
+    bloom = legacy_token_filter['bloom']
+    if (bloom is None or legacy_token_filter['stale']
+            or time.time() - legacy_token_filter['built_at'] > LEGACY_TOKEN_FILTER_TTL):
+        schedule_legacy_token_filter_rebuild()
+    if bloom is None:
+        return True
+    return token in bloom
+
+@event.listens_for(QRCode, 'after_insert')
+def add_inserted_legacy_token(mapper, connection, target):
+    bloom = legacy_token_filter['bloom']
+    if bloom is not None and is_legacy_token(target.token):
+        bloom.add(target.token)
+
+@event.listens_for(QRCode, 'after_delete')
+def evict_deleted_qr_payload(mapper, connection, target):
+    qr_payload_cache.invalidate(target.token)
+    legacy_token_filter['stale'] = True
+
+@event.listens_for(GymMachine, 'after_delete')
+def evict_deleted_machine_payloads(mapper, connection, target):
+    qr_payload_cache.invalidate_where(lambda token, payload: payload['machine_id'] == target.id)
+
+@on_machine_purged
+def evict_purged_machine_payloads(machine_id):
+    qr_payload_cache.invalidate_where(lambda token, payload: payload['machine_id'] == machine_id)
+    legacy_token_filter['stale'] = True
+
+def new_qr_fields(cipher_suite, machine_id, gym_id):
+    # Signed token: scans can verify it without a database lookup
+    token = issue_signed_token(machine_id, gym_id)
+    
+    # Create encrypted data
+    qr_data = {
+        'machine_id': machine_id,
+        'gym_id': gym_id,
+        'token': token,
+        'platform': 'fitcode'
+    }
+    
+    encrypted_data = cipher_suite.encrypt(json.dumps(qr_data).encode())
+    
+    return {
+        'machine_id': machine_id,
+        'qr_code_data': base64.b64encode(encrypted_data).decode(),
+        'token': token
+    }
 
 @qr_bp.route('/qr/generate/<int:machine_id>', methods=['POST'])
 @token_required('owner')
 def generate_qr_code(current_user, machine_id):
     try:
         cipher_suite = get_cipher_suite()  # Added to define cipher_suite
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
@@ -40,29 +217,14 @@ def generate_qr_code(current_user, machine_id):
         if existing_qr:
             return jsonify({'message': 'QR code already exists for this machine', 'qr_code': existing_qr.to_dict()}), 200
         
-        # Generate secure token
-        token = secrets.token_urlsafe(32)
-        
-        # Create encrypted data
-        qr_data = {
-            'machine_id': machine_id,
-            'gym_id': gym.id,
-            'token': token,
-            'platform': 'fitcode'
-        }
-        
-        encrypted_data = cipher_suite.encrypt(json.dumps(qr_data).encode())
-        
-        # Create QR code record
-        new_qr = QRCode(
-            machine_id=machine_id,
-            qr_code_data=base64.b64encode(encrypted_data).decode(),
-            token=token
-        )
+        new_qr = QRCode(**new_qr_fields(cipher_suite, machine_id, gym.id))
         
         db.session.add(new_qr)
         db.session.commit()
         
+        # Dashboard thumbnails and print sizes are ready before anyone asks for them
+        prerender_qr_variants(new_qr.token, gym.id, gym.logo_url)
+        
         return jsonify({
             'message': 'QR code generated successfully',
             'qr_code': new_qr.to_dict()
@@ -77,7 +239,7 @@ def generate_qr_code(current_user, machine_id):
 @token_required('owner')
 def get_qr_image(current_user, machine_id):
     try:
-        gym = Gym.query.filter_by(owner_id=current_user.id).first()
+        gym = get_owner_gym(current_user)
         
         if not gym:
             return jsonify({'message': 'No gym found for this owner'}), 404
@@ -92,111 +254,99 @@ def get_qr_image(current_user, machine_id):
         if not qr_code_record:
             return jsonify({'message': 'QR code not found for this machine'}), 404
         
-        # Create QR code image with the token (this is what gets scanned)
-        qr_content = qr_code_record.token
-        
-        qr = qrcode.QRCode(
-            version=2,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=12,
-            border=4,
-        )
-        qr.add_data(qr_content)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="#1E40AF", back_color="white").convert("RGB")
-        
-        draw = ImageDraw.Draw(img)
-        
-        # Load gym logo from URL if available
-        logo_img = None
-        if gym.logo_url:
-            try:
-                response = requests.get(gym.logo_url)
-                logo_img = Image.open(io.BytesIO(response.content))
-                # Resize logo to fit on QR code
-                max_logo_size = 80
-                logo_img.thumbnail((max_logo_size, max_logo_size), Image.ANTIALIAS)
-                # Make logo circular with white border
-                mask = Image.new("L", logo_img.size, 0)
-                draw_mask = ImageDraw.Draw(mask)
-                draw_mask.ellipse((0, 0) + logo_img.size, fill=255)
-                logo_img.putalpha(mask)
-                border_size = 4
-                border = Image.new("RGBA", (logo_img.size[0] + border_size*2, logo_img.size[1] + border_size*2), (255,255,255,255))
-                border.paste(logo_img, (border_size, border_size), logo_img)
-                logo_img = border
-            except Exception as e:
-                print(f"Failed to load gym logo: {e}")
-        
-        # Calculate positions
-        img_w, img_h = img.size
-        
-        # Paste logo at center
-        if logo_img:
-            logo_w, logo_h = logo_img.size
-            pos = ((img_w - logo_w) // 2, (img_h - logo_h) // 2)
-            img.paste(logo_img, pos, mask=logo_img)
-        
-        # Prepare font
+        size = request.args.get('size', 'standard')
+        image_format = request.args.get('format', 'png')
         try:
-            font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-            font = ImageFont.truetype(font_path, 24)
-        except Exception:
-            font = ImageFont.load_default()
-        
-        # Remove gym name and machine name text from QR code image to avoid overlap issues
-        # So no text is drawn on the QR code image
-        pass
-        
-        # Add decorative border
-        border_color = "#1E40AF"
-        border_width = 10
-        for i in range(border_width):
-            draw.rectangle([i, i, img_w - i - 1, img_h - i - 1], outline=border_color)
-        
-        # Increase gym logo size
-        logo_img = None
-        if gym.logo_url:
-            try:
-                response = requests.get(gym.logo_url)
-                logo_img = Image.open(io.BytesIO(response.content))
-                # Resize logo to fit on QR code, increased size
-                max_logo_size = 120
-                logo_img.thumbnail((max_logo_size, max_logo_size), Image.ANTIALIAS)
-                # Make logo circular with white border
-                mask = Image.new("L", logo_img.size, 0)
-                draw_mask = ImageDraw.Draw(mask)
-                draw_mask.ellipse((0, 0) + logo_img.size, fill=255)
-                logo_img.putalpha(mask)
-                border_size = 6
-                border = Image.new("RGBA", (logo_img.size[0] + border_size*2, logo_img.size[1] + border_size*2), (255,255,255,255))
-                border.paste(logo_img, (border_size, border_size), logo_img)
-                logo_img = border
-            except Exception as e:
-                print(f"Failed to load gym logo: {e}")
-        
-        # Paste logo at center
-        if logo_img:
-            logo_w, logo_h = logo_img.size
-            pos = ((img_w - logo_w) // 2, (img_h - logo_h) // 2)
-            img.paste(logo_img, pos, mask=logo_img)
-        
-        # Convert to bytes
-        img_io = io.BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/png', as_attachment=True, download_name=f'qr_code_machine_{machine_id}.png')
+            style = variant_style(size, image_format)
+        except ValueError:
+            return jsonify({'message': f"size must be one of {', '.join(QR_SIZES)} and format one of {', '.join(QR_FORMATS)}"}), 400
+        
+        # The token is what gets scanned; identical inputs always map to the same ETag
+        logo = logo_digest(gym.id, gym.logo_url)
+        etag = render_key(qr_code_record.token, logo, style)
+        if (logo or not gym.logo_url) and request.if_none_match.contains(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            not_modified.cache_control.private = True
+            not_modified.cache_control.no_cache = True
+            return not_modified
+        
+        etag, image = get_or_render_qr(qr_code_record.token, gym.id, gym.logo_url, style)
+        
+        extension = 'svg' if image_format == 'svg' else 'png'
+        suffix = '' if size == 'standard' else f'_{size}'
+        response = send_file(io.BytesIO(image), mimetype=QR_FORMATS[image_format], as_attachment=True,
+                             download_name=f'qr_code_machine_{machine_id}{suffix}.{extension}', etag=etag or False)
+        response.cache_control.private = True
+        return response
         
     except Exception as e:
         return jsonify({'message': f'Failed to generate QR image: {str(e)}'}), 500
 
+@qr_bp.route('/qr/bulk', methods=['POST'])
+@token_required('owner')
+def bulk_generate_qr_codes(current_user):
+    """Generate QR codes for every machine that lacks one and return all of them
+    as a ZIP of PNGs (format=zip, default) or a printable PDF sheet (format=pdf)."""
+    try:
+        output_format = request.args.get('format', 'zip').lower()
+        if output_format not in ('zip', 'pdf'):
+            return jsonify({'message': 'format must be zip or pdf'}), 400
+        
+        # The PDF sheet lays out standard-size codes; ZIPs can use any PNG size
+        size = request.args.get('size', 'standard') if output_format == 'zip' else 'standard'
+        if size not in QR_SIZES:
+            return jsonify({'message': f"size must be one of {', '.join(QR_SIZES)}"}), 400
+        
+        cipher_suite = get_cipher_suite()
+        gym = get_owner_gym(current_user)
+        
+        if not gym:
+            return jsonify({'message': 'No gym found for this owner'}), 404
+        
+        machines = db.session.query(GymMachine.id, GymMachine.name, QRCode.token).outerjoin(
+            QRCode, QRCode.machine_id == GymMachine.id
+        ).filter(GymMachine.gym_id == gym.id).order_by(GymMachine.id).all()
+        
+        # One transaction, batched executemany inserts for the missing codes
+        new_rows = [new_qr_fields(cipher_suite, machine_id, gym.id)
+                    for machine_id, _, token in machines if token is None]
+        for start in range(0, len(new_rows), BULK_INSERT_CHUNK):
+            db.session.execute(insert(QRCode), new_rows[start:start + BULK_INSERT_CHUNK])
+        db.session.commit()
+        
+        new_tokens = {row['machine_id']: row['token'] for row in new_rows}
+        entries = [{'machine_id': machine_id, 'name': name, 'token': token or new_tokens[machine_id]}
+                   for machine_id, name, token in machines]
+        
+        overlay_digest, logo_png = load_gym_logo_bytes(gym.id, gym.logo_url)
+        # Without the local logo the images are still produced, just not cached
+        cacheable = overlay_digest is not None or not gym.logo_url
+        style = variant_style(size, 'png')
+        
+        if output_format == 'pdf':
+            # Sheets are laid out by machine name; sort before rendering, not after
+            entries.sort(key=lambda entry: entry['name'] or '')
+            rendered = iter_rendered_qr_codes_in_order(entries, overlay_digest, logo_png, cacheable=cacheable, style=style)
+            body, mimetype = stream_qr_pdf(rendered), 'application/pdf'
+        else:
+            rendered = iter_rendered_qr_codes(entries, overlay_digest, logo_png, cacheable=cacheable, style=style)
+            body, mimetype = stream_qr_zip(rendered), 'application/zip'
+        
+        response = Response(body, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=gym_{gym.id}_qr_codes.{output_format}'
+        response.headers['X-QR-Codes-Generated'] = str(len(new_rows))
+        return response
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"Failed to bulk generate QR codes: {e}")
+        return jsonify({'message': f'Failed to bulk generate QR codes: {str(e)}'}), 500
+
 @qr_bp.route('/qr/scan', methods=['POST'])
 @token_required('client')
 def scan_qr_code(current_user):
     try:
-        cipher_suite = get_cipher_suite()  # Added to define cipher_suite
         data = request.get_json()
         
         if not data or not data.get('token'):
@@ -205,58 +355,30 @@ def scan_qr_code(current_user):
         token = data['token']
         print(f"Scan QR code token received: {token}")  # Added logging
         
-        # Find QR code by token
-        qr_code_record = QRCode.query.filter_by(token=token).first()
-        
-        if not qr_code_record:
-            print(f"Invalid QR code token: {token}")  # Added logging
-            return jsonify({'message': 'Invalid QR code'}), 404
-        
-        # Decrypt and verify data
+        # Find and verify the QR code (cached after the first successful scan)
         try:
-            encrypted_data = base64.b64decode(qr_code_record.qr_code_data.encode())
-            decrypted_data = cipher_suite.decrypt(encrypted_data)
-            qr_data = json.loads(decrypted_data.decode())
-            
-            if qr_data.get('platform') != 'fitcode':
-                print(f"QR code platform mismatch: {qr_data.get('platform')}")  # Added logging
+            qr_payload = lookup_qr_payload(token)
+        except InvalidQRPayload as ex:
+            print(ex)  # Added logging
+            if ex.reason == 'platform':
                 return jsonify({'message': 'QR code not compatible with this platform'}), 400
-                
-        except Exception as ex:
-            import traceback
-            print(f"QR code decryption error for token {token}: {ex}")
-            traceback.print_exc()
             return jsonify({'message': 'Invalid QR code data'}), 400
         
-        # Get machine and gym information
-        machine = GymMachine.query.get(qr_code_record.machine_id)
-        if not machine:
-            print(f"Machine not found for QR code token: {token}")  # Added logging
-            return jsonify({'message': 'Machine not found'}), 404
+        if not qr_payload:
+            print(f"Invalid QR code token: {token}")  # Added logging
+            return jsonify({'message': 'Invalid QR code'}), 404
         
-        gym = Gym.query.get(machine.gym_id)
-        if not gym:
-            print(f"Gym not found for machine id {machine.id}")  # Added logging
-            return jsonify({'message': 'Gym not found'}), 404
-        
-        # Record scan history
-        scan_record = ScanHistory(
-            client_id=current_user.id,
-            machine_id=machine.id
-        )
-        db.session.add(scan_record)
-        db.session.commit()
+        # Machine, gym and multilingual content come pre-serialized per machine
+        try:
+            gym_id, card = get_scan_card(qr_payload['machine_id'])
+        except LookupError as ex:
+            print(f"{ex} for QR code token: {token}")  # Added logging
+            return jsonify({'message': str(ex)}), 404
         
-        # Get multilingual content
-        from src.models.gym import MultilingualContent
-        multilingual_content = MultilingualContent.query.filter_by(machine_id=machine.id).all()
+        # Record scan history; the row is written behind the response in a batch
+        scan_recorder.record(current_user.id, qr_payload['machine_id'], gym_id)
         
-        return jsonify({
-            'message': 'QR code scanned successfully',
-            'machine': machine.to_dict(),
-            'gym': gym.to_dict(),
-            'multilingual_content': [content.to_dict() for content in multilingual_content]
-        }), 200
+        return Response(card, status=200, mimetype='application/json')
         
     except Exception as e:
         db.session.rollback()
@@ -267,25 +389,24 @@ def scan_qr_code(current_user):
 def validate_qr_token(token):
     """Public endpoint to validate if a token is from our platform"""
     try:
-        qr_code_record = QRCode.query.filter_by(token=token).first()
-        
-        if not qr_code_record:
-            return jsonify({'valid': False, 'message': 'Invalid token'}), 404
+        allowed, retry_after = validate_limiter.allow(client_ip())
+        if not allowed:
+            response = jsonify({'valid': False, 'message': 'Too many requests'})
+            response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return response, 429
         
-        # Decrypt and verify data
         try:
-            encrypted_data = base64.b64decode(qr_code_record.qr_code_data.encode())
-            decrypted_data = cipher_suite.decrypt(encrypted_data)
-            qr_data = json.loads(decrypted_data.decode())
-            
-            if qr_data.get('platform') != 'fitcode':
+            qr_payload = lookup_qr_payload(token)
+        except InvalidQRPayload as ex:
+            if ex.reason == 'platform':
                 return jsonify({'valid': False, 'message': 'Not a Fitcode QR code'}), 400
-                
-            return jsonify({'valid': True, 'platform': 'fitcode'}), 200
-                
-        except Exception:
             return jsonify({'valid': False, 'message': 'Invalid QR code data'}), 400
         
+        if not qr_payload:
+            return jsonify({'valid': False, 'message': 'Invalid token'}), 404
+        
+        return jsonify({'valid': True, 'platform': 'fitcode'}), 200
+        
     except Exception as e:
         return jsonify({'valid': False, 'message': f'Validation failed: {str(e)}'}), 500
 
@@ -0,0 +1,119 @@
+from flask import Blueprint, request, jsonify
+from src.models.gym import db, GymMachine
+from src.routes.auth import token_required, get_owner_gym
+from src.utils.media_store import (
+    UploadError, create_upload, get_upload, append_chunk, complete_upload, abort_upload, COPY_BUFFER_SIZE
+)
+from src.utils.scan_cards import invalidate_machine_card
+
+video_upload_bp = Blueprint('video_uploads', __name__)
+
+RECOMMENDED_CHUNK_SIZE = 8 * COPY_BUFFER_SIZE
+
+def upload_error_response(error):
+    body = {'message': str(error)}
+    if error.offset is not None:
+        body['offset'] = error.offset
+    return jsonify(body), error.status
+
+def upload_status(meta):
+    return {
+        'upload_id': meta['upload_id'],
+        'filename': meta['filename'],
+        'size': meta['size'],
+        'offset': meta['offset']
+    }
+
+@video_upload_bp.route('/video-uploads', methods=['POST'])
+@token_required('owner')
+def start_video_upload(current_user):
+    try:
+        data = request.get_json() or {}
+        if not data.get('filename'):
+            return jsonify({'message': 'filename is required'}), 400
+        size = data.get('size')
+        if size is not None and not isinstance(size, int):
+            return jsonify({'message': 'size must be an integer number of bytes'}), 400
+
+        upload_id = create_upload(current_user.id, data['filename'], size)
+        return jsonify({
+            'upload_id': upload_id,
+            'offset': 0,
+            'chunk_size': RECOMMENDED_CHUNK_SIZE
+        }), 201
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({'message': f'Failed to start upload: {str(e)}'}), 500
+
+@video_upload_bp.route('/video-uploads/<upload_id>', methods=['GET'])
+@token_required('owner')
+def get_video_upload(current_user, upload_id):
+    """Resume point for an interrupted upload: send the next chunk at 'offset'."""
+    try:
+        return jsonify(upload_status(get_upload(upload_id, current_user.id))), 200
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({'message': f'Failed to retrieve upload: {str(e)}'}), 500
+
+@video_upload_bp.route('/video-uploads/<upload_id>', methods=['PUT', 'PATCH'])
+@token_required('owner')
+def upload_video_chunk(current_user, upload_id):
+    try:
+        offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+        if offset is None or not str(offset).isdigit():
+            return jsonify({'message': 'Upload-Offset header or offset parameter is required'}), 400
+
+        new_offset = append_chunk(upload_id, current_user.id, int(offset), request.stream)
+        return jsonify({'upload_id': upload_id, 'offset': new_offset}), 200
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({'message': f'Failed to store chunk: {str(e)}'}), 500
+
+@video_upload_bp.route('/video-uploads/<upload_id>/complete', methods=['POST'])
+@token_required('owner')
+def complete_video_upload(current_user, upload_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        machine = None
+        if data.get('machine_id'):
+            gym = get_owner_gym(current_user)
+            machine = GymMachine.query.filter_by(id=data['machine_id'], gym_id=gym.id).first() if gym else None
+            if not machine:
+                return jsonify({'message': 'Machine not found'}), 404
+
+        local_video_path, digest, deduplicated = complete_upload(upload_id, current_user.id)
+
+        if machine:
+            machine.local_video_path = local_video_path
+            db.session.commit()
+            invalidate_machine_card(machine.id)
+
+        return jsonify({
+            'message': 'Upload completed',
+            'local_video_path': local_video_path,
+            'sha256': digest,
+            'deduplicated': deduplicated,
+            'machine': machine.to_dict() if machine else None
+        }), 200
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Failed to complete upload: {str(e)}'}), 500
+
+@video_upload_bp.route('/video-uploads/<upload_id>', methods=['DELETE'])
+@token_required('owner')
+def abort_video_upload(current_user, upload_id):
+    try:
+        abort_upload(upload_id, current_user.id)
+        return jsonify({'message': 'Upload aborted'}), 200
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        return jsonify({'message': f'Failed to abort upload: {str(e)}'}), 500
@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class ContentCache:
+    """Content-addressed blob store on local disk.
+
+    Keys are hex digests of everything that determines the blob, so entries
+    never need invalidating; writes go through a temp file and os.replace so
+    concurrent workers never observe a partial file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def get(self, key):
+        try:
+            with open(self.path_for(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        write_atomic(path, data)
+        return path
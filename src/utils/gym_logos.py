@@ -0,0 +1,152 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import requests
+from PIL import Image, ImageDraw
+from src.utils.content_cache import write_atomic
+
+# Gym logos are downloaded once per create/update, preprocessed into the circular
+# overlay pasted on QR codes and kept on local disk. QR rendering only ever reads
+# the local copy; a missing copy triggers a background fetch, never a blocking one.
+LOGO_DIR = os.getenv(
+    'GYM_LOGO_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'logos')
+)
+FETCH_TIMEOUT = float(os.getenv('GYM_LOGO_FETCH_TIMEOUT', 5))
+MAX_LOGO_SIZE = 120
+LOGO_BORDER = 6
+# After a failed fetch, misses for the same gym and URL wait this long before retrying
+FETCH_RETRY_AFTER = float(os.getenv('GYM_LOGO_RETRY_AFTER', 300))
+
+# Keyed on (gym_id, logo_url): a new URL is fetched even while an old one is in flight
+_pending = set()
+_retry_after = {}
+_pending_lock = threading.Lock()
+# Keeps each overlay and its metadata a matching pair when fetches for one gym overlap
+_write_lock = threading.Lock()
+
+def _paths(gym_id):
+    return os.path.join(LOGO_DIR, f'{gym_id}.png'), os.path.join(LOGO_DIR, f'{gym_id}.json')
+
+def _read_meta(gym_id):
+    try:
+        with open(_paths(gym_id)[1]) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def preprocess_logo(raw_bytes):
+    logo_img = Image.open(io.BytesIO(raw_bytes)).convert('RGBA')
+    logo_img.thumbnail((MAX_LOGO_SIZE, MAX_LOGO_SIZE), Image.LANCZOS)
+    # Make logo circular with white border
+    mask = Image.new("L", logo_img.size, 0)
+    draw_mask = ImageDraw.Draw(mask)
+    draw_mask.ellipse((0, 0) + logo_img.size, fill=255)
+    logo_img.putalpha(mask)
+    border = Image.new("RGBA", (logo_img.size[0] + LOGO_BORDER*2, logo_img.size[1] + LOGO_BORDER*2), (255,255,255,255))
+    border.paste(logo_img, (LOGO_BORDER, LOGO_BORDER), logo_img)
+
+    out = io.BytesIO()
+    border.save(out, 'PNG')
+    return out.getvalue()
+
+def refresh_gym_logo(gym_id, logo_url):
+    """Fetch and preprocess a gym's logo, revalidating with the stored ETag."""
+    png_path, meta_path = _paths(gym_id)
+    if not logo_url:
+        with _write_lock:
+            for path in (png_path, meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return None
+
+    meta = _read_meta(gym_id)
+    headers = {}
+    if meta and meta.get('url') == logo_url and os.path.exists(png_path):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = requests.get(logo_url, headers=headers, timeout=FETCH_TIMEOUT)
+    if response.status_code == 304:
+        return meta
+    response.raise_for_status()
+
+    overlay = preprocess_logo(response.content)
+    meta = {
+        'url': logo_url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'digest': hashlib.sha256(overlay).hexdigest()
+    }
+    with _write_lock:
+        write_atomic(png_path, overlay)
+        write_atomic(meta_path, json.dumps(meta).encode())
+    return meta
+
+def _refresh_in_background(gym_id, logo_url):
+    key = (gym_id, logo_url)
+    try:
+        refresh_gym_logo(gym_id, logo_url)
+        with _pending_lock:
+            _retry_after.pop(key, None)
+    except Exception as e:
+        print(f"Failed to refresh logo for gym {gym_id}: {e}")
+        with _pending_lock:
+            _retry_after[key] = time.monotonic() + FETCH_RETRY_AFTER
+    finally:
+        with _pending_lock:
+            _pending.discard(key)
+
+def schedule_logo_refresh(gym_id, logo_url, force=False):
+    """Fetch the logo in the background unless that fetch is already running or,
+    unless forced (the owner just set the URL), failed less than FETCH_RETRY_AFTER ago."""
+    key = (gym_id, logo_url)
+    with _pending_lock:
+        if key in _pending:
+            return False
+        if not force and _retry_after.get(key, 0) > time.monotonic():
+            return False
+        _retry_after.pop(key, None)
+        _pending.add(key)
+    threading.Thread(target=_refresh_in_background, args=(gym_id, logo_url), daemon=True).start()
+    return True
+
+def logo_digest(gym_id, logo_url):
+    """Digest of the locally stored overlay for logo_url, or None if not stored yet."""
+    if not logo_url:
+        return None
+    meta = _read_meta(gym_id)
+    if meta and meta.get('url') == logo_url and os.path.exists(_paths(gym_id)[0]):
+        return meta['digest']
+    return None
+
+def load_gym_logo_bytes(gym_id, logo_url):
+    """Return (digest, overlay PNG bytes) from local disk, or (None, None)."""
+    digest = logo_digest(gym_id, logo_url)
+    if digest is None:
+        if logo_url:
+            schedule_logo_refresh(gym_id, logo_url)
+        return None, None
+    try:
+        with open(_paths(gym_id)[0], 'rb') as f:
+            return digest, f.read()
+    except FileNotFoundError:
+        return None, None
+
+def load_gym_logo(gym_id, logo_url):
+    """Return (digest, RGBA overlay) from local disk, or (None, None) if unavailable."""
+    digest, logo_png = load_gym_logo_bytes(gym_id, logo_url)
+    if digest is None:
+        return None, None
+    try:
+        logo_img = Image.open(io.BytesIO(logo_png))
+        logo_img.load()
+        return digest, logo_img
+    except Exception as e:
+        print(f"Failed to read cached logo for gym {gym_id}: {e}")
+        return None, None
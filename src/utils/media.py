@@ -0,0 +1,131 @@
+import hashlib
+import mimetypes
+import os
+import re
+from flask import request, Response, abort
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+# How media bytes leave the process:
+#   none        - the worker streams the file (zero-copy sendfile under gunicorn for open-ended ranges)
+#   x-sendfile  - Apache mod_xsendfile / lighttpd read the absolute path from X-Sendfile
+#   x-accel     - nginx serves X-Accel-Redirect: <MEDIA_ACCEL_PREFIX>/<location>/<file> from an
+#                 `internal` location aliased to the matching directory, e.g.
+#                     location /_media/uploads/ { internal; alias /srv/app/src/uploads/; }
+# In the offload modes the proxy answers Range requests itself; the worker only
+# checks the path and sets the validators and cache headers.
+SENDFILE_MODE = os.getenv('MEDIA_SENDFILE_MODE', 'none').lower()
+ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/_media').rstrip('/')
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 3600))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STREAM_BUFFER_SIZE = 256 * 1024
+
+# Files named by their SHA-256 (uploads/videos/<sha256>.<ext>) never change
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{64}$')
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag_for(path, st):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if CONTENT_ADDRESSED.match(stem):
+        return stem, True
+    material = f'{st.st_ino}-{st.st_size}-{st.st_mtime_ns}'
+    return hashlib.sha1(material.encode()).hexdigest()[:32], False
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single byte range, None to send the
+    whole file, or 'unsatisfiable'. Multi-range requests get the whole file."""
+    if not header:
+        return None
+    match = RANGE_HEADER.match(header.replace(' ', ''))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+def _iter_range(f, length):
+    try:
+        while length > 0:
+            block = f.read(min(STREAM_BUFFER_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+def send_media(directory, filename, accel_location):
+    """Serve a media file with Range support, strong ETags and cache headers.
+
+    accel_location names the nginx internal location used in x-accel mode.
+    """
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    etag, immutable = _etag_for(path, st)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable
+                          else f'public, max-age={MEDIA_MAX_AGE}')
+    }
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if etag in [tag.strip(' "') for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=304, headers=headers)
+
+    if SENDFILE_MODE == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(mimetype=mimetype, headers=headers)
+    if SENDFILE_MODE == 'x-accel':
+        relative = os.path.relpath(path, directory).replace(os.sep, '/')
+        headers['X-Accel-Redirect'] = f'{ACCEL_PREFIX}/{accel_location}/{relative}'
+        return Response(mimetype=mimetype, headers=headers)
+
+    size = st.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if not if_range or if_range.strip(' "') == etag:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    if byte_range == 'unsatisfiable':
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = max(0, end - start + 1)
+    headers['Content-Length'] = str(length)
+    status = 200
+    if byte_range:
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    if request.method == 'HEAD':
+        return Response(status=status, mimetype=mimetype, headers=headers)
+
+    f = open(path, 'rb')
+    f.seek(start)
+    if end == size - 1:
+        # Runs to EOF, so the server's file wrapper (gunicorn: os.sendfile) can take it
+        body = wrap_file(request.environ, f, STREAM_BUFFER_SIZE)
+    else:
+        body = _iter_range(f, length)
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent chunk writes to one upload are not guarded
+    fcntl = None
+
+# Videos are stored once per content hash under uploads/videos/<sha256><ext>, and
+# machines reference that path. Chunked uploads are assembled under uploads/.partial.
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+VIDEO_DIR = os.path.join(UPLOAD_ROOT, 'videos')
+PARTIAL_DIR = os.path.join(UPLOAD_ROOT, '.partial')
+COPY_BUFFER_SIZE = 1024 * 1024
+MAX_VIDEO_BYTES = int(os.getenv('MAX_VIDEO_UPLOAD_BYTES', 500 * 1024 * 1024))
+PARTIAL_UPLOAD_TTL = int(os.getenv('PARTIAL_UPLOAD_TTL', 24 * 3600))
+ALLOWED_VIDEO_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.webm', '.mkv', '.avi'}
+
+# Running hashes of in-progress uploads handled by this worker: upload_id -> (offset, hasher).
+# A chunk that lands on another worker rebuilds the hash from the bytes on disk.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+@contextmanager
+def _exclusive(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def video_extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    if ext not in ALLOWED_VIDEO_EXTENSIONS:
+        raise UploadError(f"Unsupported video type '{ext or filename}'")
+    return ext
+
+def relative_video_path(digest, ext):
+    return f'uploads/videos/{digest}{ext}'
+
+def _finalize(tmp_path, digest, ext):
+    """Move a fully written temp file to its content address; returns (path, deduplicated)."""
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+    target = os.path.join(VIDEO_DIR, f'{digest}{ext}')
+    if os.path.exists(target):
+        os.remove(tmp_path)
+        return relative_video_path(digest, ext), True
+    os.replace(tmp_path, target)
+    return relative_video_path(digest, ext), False
+
+def store_video_stream(stream, filename):
+    """Save a single-request upload by content hash; returns (relative path, deduplicated)."""
+    ext = video_extension(filename)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    tmp_path = os.path.join(PARTIAL_DIR, f'direct-{secrets.token_hex(8)}{ext}')
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                block = stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > MAX_VIDEO_BYTES:
+                    raise UploadError('Video exceeds the maximum upload size', status=413)
+                hasher.update(block)
+                f.write(block)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return _finalize(tmp_path, hasher.hexdigest(), ext)
+
+def _upload_paths(upload_id):
+    if not upload_id.isalnum():
+        raise UploadError('Upload not found', status=404)
+    base = os.path.join(PARTIAL_DIR, upload_id)
+    return base + '.part', base + '.json'
+
+def _sweep_stale_uploads():
+    if not os.path.isdir(PARTIAL_DIR):
+        return
+    cutoff = time.time() - PARTIAL_UPLOAD_TTL
+    for name in os.listdir(PARTIAL_DIR):
+        path = os.path.join(PARTIAL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def create_upload(owner_id, filename, size=None):
+    ext = video_extension(filename)
+    if size is not None and (size < 0 or size > MAX_VIDEO_BYTES):
+        raise UploadError('Video exceeds the maximum upload size', status=413)
+    _sweep_stale_uploads()
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    upload_id = secrets.token_hex(16)
+    part_path, meta_path = _upload_paths(upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump({'owner_id': owner_id, 'filename': filename, 'ext': ext, 'size': size, 'created_at': time.time()}, f)
+    return upload_id
+
+def get_upload(upload_id, owner_id):
+    part_path, meta_path = _upload_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise UploadError('Upload not found', status=404)
+    if meta['owner_id'] != owner_id:
+        raise UploadError('Upload not found', status=404)
+    meta['upload_id'] = upload_id
+    meta['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return meta
+
+def _hasher_at(upload_id, part_file, offset):
+    with _hashers_lock:
+        state = _hashers.get(upload_id)
+    if state and state[0] == offset:
+        # A copy: a failed append must not leave bytes in the cached hasher that are not on disk
+        return state[1].copy()
+    hasher = hashlib.sha256()
+    part_file.seek(0)
+    remaining = offset
+    while remaining:
+        block = part_file.read(min(COPY_BUFFER_SIZE, remaining))
+        if not block:
+            break
+        hasher.update(block)
+        remaining -= len(block)
+    return hasher
+
+def append_chunk(upload_id, owner_id, offset, stream):
+    """Append a chunk that must start at the current end of the upload; returns the new offset."""
+    meta = get_upload(upload_id, owner_id)
+    part_path, _ = _upload_paths(upload_id)
+    limit = meta['size'] if meta['size'] is not None else MAX_VIDEO_BYTES
+
+    with open(part_path, 'r+b') as f, _exclusive(f):
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadError('Offset does not match the bytes received so far', status=409, offset=current)
+        hasher = _hasher_at(upload_id, f, current)
+        f.seek(current)
+        try:
+            while True:
+                block = stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                if current + len(block) > limit:
+                    f.truncate(offset)
+                    raise UploadError('Chunk goes past the declared upload size', status=413, offset=offset)
+                f.write(block)
+                hasher.update(block)
+                current += len(block)
+        except BaseException:
+            # The next append rehashes whatever actually reached the disk
+            with _hashers_lock:
+                _hashers.pop(upload_id, None)
+            raise
+        with _hashers_lock:
+            _hashers[upload_id] = (current, hasher)
+    return current
+
+def complete_upload(upload_id, owner_id):
+    """Seal an upload into the content-addressed store; returns (relative path, digest, deduplicated)."""
+    meta = get_upload(upload_id, owner_id)
+    part_path, meta_path = _upload_paths(upload_id)
+    if meta['size'] is not None and meta['offset'] != meta['size']:
+        raise UploadError(f"Upload is incomplete: {meta['offset']} of {meta['size']} bytes received",
+                          status=409, offset=meta['offset'])
+
+    with open(part_path, 'rb') as f:
+        digest = _hasher_at(upload_id, f, meta['offset']).hexdigest()
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+    path, deduplicated = _finalize(part_path, digest, meta['ext'])
+    os.remove(meta_path)
+    return path, digest, deduplicated
+
+def abort_upload(upload_id, owner_id):
+    get_upload(upload_id, owner_id)
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    for path in _upload_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,57 @@
+from src.models.gym import db, MultilingualContent
+
+TRANSLATED_FIELDS = ('instruction_text', 'safety_text')
+
+
+def normalize_translations(entries):
+    """Map language_code -> the translated fields present in a multilingual_content
+    payload. Entries without a language_code are skipped; later entries for the
+    same language win."""
+    translations = {}
+    for content in entries or []:
+        if isinstance(content, dict) and content.get('language_code'):
+            translations.setdefault(content['language_code'], {}).update(
+                {field: content[field] for field in TRANSLATED_FIELDS if field in content}
+            )
+    return translations
+
+def sync_translations(machine_id, entries, replace=True):
+    """Apply a multilingual_content payload to a machine as a diff.
+
+    Only rows whose text actually differs are written, so untouched languages
+    keep their ids and created_at. With replace=True the payload is the full set:
+    languages missing from it are removed and fields missing from an entry are
+    cleared. With replace=False only the given languages and fields change.
+    Returns {'added', 'updated', 'removed', 'unchanged'} lists of language codes;
+    the caller commits.
+    """
+    desired = normalize_translations(entries)
+    existing = {
+        row.language_code: row
+        for row in MultilingualContent.query.filter_by(machine_id=machine_id)
+    }
+    changes = {'added': [], 'updated': [], 'removed': [], 'unchanged': []}
+
+    for language_code, values in desired.items():
+        if replace:
+            values = {field: values.get(field) for field in TRANSLATED_FIELDS}
+        row = existing.get(language_code)
+        if row is None:
+            db.session.add(MultilingualContent(machine_id=machine_id, language_code=language_code, **values))
+            changes['added'].append(language_code)
+        elif any(getattr(row, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(row, field, value)
+            changes['updated'].append(language_code)
+        else:
+            changes['unchanged'].append(language_code)
+
+    if replace:
+        for language_code, row in existing.items():
+            if language_code not in desired:
+                db.session.delete(row)
+                changes['removed'].append(language_code)
+    return changes
+
+def translations_changed(changes):
+    return bool(changes['added'] or changes['updated'] or changes['removed'])
@@ -0,0 +1,25 @@
+import os
+from werkzeug.security import generate_password_hash, check_password_hash
+from src.utils.workers import BoundedProcessPool, PoolSaturated
+
+# Password KDF work (scrypt by default) runs in a small process pool so request
+# threads only wait on it; once MAX_PENDING jobs are queued new logins get a 503.
+USE_HASH_POOL = os.getenv('PASSWORD_HASH_POOL', '1') == '1'
+
+hash_pool = BoundedProcessPool(
+    max_workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+    max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', 16)),
+    acquire_timeout=float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 0.5))
+)
+
+RETRY_AFTER_SECONDS = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', 2))
+
+def hash_password(password):
+    if not USE_HASH_POOL:
+        return generate_password_hash(password)
+    return hash_pool.run(generate_password_hash, password)
+
+def verify_password(password_hash, password):
+    if not USE_HASH_POOL:
+        return check_password_hash(password_hash, password)
+    return hash_pool.run(check_password_hash, password_hash, password)
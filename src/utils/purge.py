@@ -0,0 +1,107 @@
+import os
+import threading
+from sqlalchemy import delete, select
+from src.models.gym import db, GymMachine, GymClient, QRCode, MultilingualContent, ScanHistory, BookmarkedMachine, ScanDailyRollup, RefreshToken
+from src.utils.scan_recorder import scan_recorder
+from src.utils.rollups import subtract_scans
+
+# Machines and clients are deleted with chunked Core DELETEs instead of ORM
+# cascades, which load every child row into the session first. Each chunk is
+# its own short transaction, so memory and lock time stay bounded no matter
+# how much scan history there is.
+PURGE_CHUNK_SIZE = int(os.getenv('PURGE_CHUNK_SIZE', 5000))
+
+# Bulk deletes bypass ORM after_delete events, so caches that evict on those
+# events register here as well: fn(machine_id) / fn(client_id), called after commit.
+machine_purge_hooks = []
+client_purge_hooks = []
+
+def on_machine_purged(fn):
+    machine_purge_hooks.append(fn)
+    return fn
+
+def on_client_purged(fn):
+    client_purge_hooks.append(fn)
+    return fn
+
+def delete_in_chunks(model, column, value, chunk_size=None, before_delete=None):
+    """DELETE rows of model where column == value, chunk_size rows per transaction.
+
+    before_delete(ids) runs in each chunk's transaction, so whatever it derives
+    from the rows commits or rolls back together with their deletion.
+    """
+    chunk_size = chunk_size or PURGE_CHUNK_SIZE
+    deleted = 0
+    while True:
+        ids = select(model.id).where(column == value).limit(chunk_size)
+        if before_delete is not None:
+            ids = db.session.scalars(ids).all()
+            if ids:
+                before_delete(ids)
+        result = db.session.execute(delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+
+def _run_hooks(hooks, key):
+    for hook in hooks:
+        try:
+            hook(key)
+        except Exception as e:
+            print(f"Purge hook {hook.__name__} failed for {key}: {e}")
+
+def purge_machine(machine_id):
+    """Delete a machine and everything that references it; returns rows deleted per table."""
+    # Scans still queued for this machine would fail their foreign key once it is gone
+    scan_recorder.discard(machine_id=machine_id)
+    counts = {
+        'scan_history': delete_in_chunks(ScanHistory, ScanHistory.machine_id, machine_id),
+        'bookmarked_machines': delete_in_chunks(BookmarkedMachine, BookmarkedMachine.machine_id, machine_id),
+        'multilingual_content': delete_in_chunks(MultilingualContent, MultilingualContent.machine_id, machine_id),
+        'qr_codes': delete_in_chunks(QRCode, QRCode.machine_id, machine_id),
+        'scan_daily_rollups': db.session.execute(
+            delete(ScanDailyRollup).where(ScanDailyRollup.machine_id == machine_id)
+        ).rowcount
+    }
+    counts['gym_machines'] = db.session.execute(delete(GymMachine).where(GymMachine.id == machine_id)).rowcount
+    db.session.commit()
+    _run_hooks(machine_purge_hooks, machine_id)
+    # ...and so would any recorded from a cached scan card while the purge ran
+    scan_recorder.discard(machine_id=machine_id)
+    return counts
+
+def purge_client(client_id):
+    """Delete a client account with its scan history and bookmarks; returns rows deleted per table.
+
+    The account row goes last: if the purge fails partway the client can still
+    authenticate and the same call finishes the job.
+    """
+    scan_recorder.discard(client_id=client_id)
+    counts = {
+        # Each chunk leaves the daily counts in the same transaction that deletes it
+        'scan_history': delete_in_chunks(ScanHistory, ScanHistory.client_id, client_id, before_delete=subtract_scans),
+        'bookmarked_machines': delete_in_chunks(BookmarkedMachine, BookmarkedMachine.client_id, client_id)
+    }
+    counts['refresh_tokens'] = db.session.execute(delete(RefreshToken).where(
+        RefreshToken.user_type == 'client', RefreshToken.user_id == client_id
+    )).rowcount
+    counts['gym_clients'] = db.session.execute(delete(GymClient).where(GymClient.id == client_id)).rowcount
+    db.session.commit()
+    _run_hooks(client_purge_hooks, client_id)
+    scan_recorder.discard(client_id=client_id)
+    return counts
+
+def _purge_in_background(app, purge, key):
+    with app.app_context():
+        try:
+            counts = purge(key)
+            print(f"Background {purge.__name__}({key}) finished: {counts}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Background {purge.__name__}({key}) failed: {e}")
+        finally:
+            db.session.remove()
+
+def schedule_purge(app, purge, key):
+    threading.Thread(target=_purge_in_background, args=(app, purge, key), daemon=True).start()
@@ -0,0 +1,211 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import qrcode
+from PIL import Image, ImageDraw
+from src.utils.content_cache import ContentCache
+from src.utils.gym_logos import load_gym_logo, load_gym_logo_bytes, logo_digest, schedule_logo_refresh
+from src.utils.workers import BoundedProcessPool, PoolSaturated
+
+# Everything that affects the rendered pixels. Bump STYLE_VERSION when the
+# drawing code changes so previously cached renders stop matching.
+STYLE_VERSION = 1
+QR_STYLE = {
+    'version': 2,
+    'error_correction': 'H',
+    'box_size': 12,
+    'border': 4,
+    'fill_color': '#1E40AF',
+    'back_color': 'white',
+    'frame_width': 10
+}
+
+# Sizes selectable with ?size=; 'standard' is QR_STYLE itself, so its cache keys
+# are the same as before sizes existed. The logo overlay is stored for the
+# standard box size and scaled with the modules.
+QR_SIZES = {
+    'thumb': {'box_size': 3, 'frame_width': 3},
+    'standard': {},
+    'print': {'box_size': 24, 'frame_width': 20}
+}
+QR_FORMATS = {
+    'png': 'image/png',
+    'png8': 'image/png',    # palette PNG, a fraction of the size for previews
+    'svg': 'image/svg+xml'
+}
+# Rendered in the background as soon as a QR code is generated
+EAGER_VARIANTS = [('thumb', 'png8'), ('standard', 'png'), ('print', 'png')]
+
+CACHE_DIR = os.getenv(
+    'QR_RENDER_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'qr')
+)
+qr_image_cache = ContentCache(CACHE_DIR)
+
+# Batch renders (bulk export, eager variants) fan out across these processes
+render_pool = BoundedProcessPool(
+    max_workers=int(os.getenv('QR_RENDER_WORKERS', os.cpu_count() or 2)),
+    max_pending=int(os.getenv('QR_RENDER_MAX_PENDING', 64))
+)
+
+def variant_style(size='standard', image_format='png'):
+    if size not in QR_SIZES or image_format not in QR_FORMATS:
+        raise ValueError(f"Unknown QR variant {size}/{image_format}")
+    style = dict(QR_STYLE, **QR_SIZES[size])
+    if image_format != 'png':
+        style['format'] = image_format
+    return style
+
+def render_key(token, logo_digest, style=QR_STYLE):
+    material = json.dumps({
+        'token': token,
+        'logo': logo_digest,
+        'style': style,
+        'style_version': STYLE_VERSION
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def _qr_matrix(token, style):
+    qr = qrcode.QRCode(
+        version=style['version'],
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=style['box_size'],
+        border=style['border'],
+    )
+    qr.add_data(token)
+    qr.make(fit=True)
+    return qr
+
+def _scaled_logo(logo_img, style):
+    scale = style['box_size'] / QR_STYLE['box_size']
+    if scale == 1:
+        return logo_img
+    size = (max(1, round(logo_img.size[0] * scale)), max(1, round(logo_img.size[1] * scale)))
+    return logo_img.resize(size, Image.LANCZOS)
+
+def render_qr_png(token, logo_img=None, style=QR_STYLE):
+    qr = _qr_matrix(token, style)
+    img = qr.make_image(fill_color=style['fill_color'], back_color=style['back_color']).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    img_w, img_h = img.size
+
+    # Add decorative border
+    draw.rectangle([0, 0, img_w - 1, img_h - 1], outline=style['fill_color'], width=style['frame_width'])
+
+    # Paste the gym logo at the center
+    if logo_img:
+        logo_img = _scaled_logo(logo_img, style)
+        logo_w, logo_h = logo_img.size
+        pos = ((img_w - logo_w) // 2, (img_h - logo_h) // 2)
+        img.paste(logo_img, pos, mask=logo_img)
+
+    img_io = io.BytesIO()
+    if style.get('format') == 'png8':
+        img.convert('P', palette=Image.ADAPTIVE, colors=64).save(img_io, 'PNG', optimize=True)
+    else:
+        img.save(img_io, 'PNG')
+    return img_io.getvalue()
+
+def render_qr_svg(token, logo_img=None, style=QR_STYLE):
+    qr = _qr_matrix(token, style)
+    matrix = qr.get_matrix()  # includes the quiet-zone border
+    box = style['box_size']
+    side = len(matrix) * box
+    frame = style['frame_width']
+
+    # One path for all dark modules, merging horizontal runs
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                path.append(f'M{start * box},{y * box}h{(x - start) * box}v{box}h-{(x - start) * box}z')
+            else:
+                x += 1
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {side} {side}" width="{side}" height="{side}">',
+        f'<rect width="{side}" height="{side}" fill="{style["back_color"]}"/>',
+        f'<path fill="{style["fill_color"]}" d="{"".join(path)}"/>',
+        f'<rect x="{frame / 2}" y="{frame / 2}" width="{side - frame}" height="{side - frame}" '
+        f'fill="none" stroke="{style["fill_color"]}" stroke-width="{frame}"/>'
+    ]
+    if logo_img:
+        logo_img = _scaled_logo(logo_img, style)
+        logo_io = io.BytesIO()
+        logo_img.save(logo_io, 'PNG')
+        logo_w, logo_h = logo_img.size
+        parts.append(
+            f'<image x="{(side - logo_w) // 2}" y="{(side - logo_h) // 2}" width="{logo_w}" height="{logo_h}" '
+            f'href="data:image/png;base64,{base64.b64encode(logo_io.getvalue()).decode()}"/>'
+        )
+    parts.append('</svg>')
+    return ''.join(parts).encode()
+
+def render_qr(token, logo_img=None, style=QR_STYLE):
+    if style.get('format') == 'svg':
+        return render_qr_svg(token, logo_img, style)
+    return render_qr_png(token, logo_img, style)
+
+def render_qr_from_bytes(token, logo_png=None, style=QR_STYLE):
+    # Picklable entry point for render_pool: the logo travels as PNG bytes
+    logo_img = Image.open(io.BytesIO(logo_png)) if logo_png else None
+    return render_qr(token, logo_img, style)
+
+def render_variants_to_cache(token, logo_digest, logo_png, styles):
+    # Runs inside render_pool; writes straight into the shared disk cache
+    logo_img = Image.open(io.BytesIO(logo_png)) if logo_png else None
+    for style in styles:
+        key = render_key(token, logo_digest, style)
+        if not qr_image_cache.exists(key):
+            qr_image_cache.put(key, render_qr(token, logo_img, style))
+    return len(styles)
+
+def _report_prerender_failure(future):
+    if future.exception() is not None:
+        print(f"Failed to pre-render QR variants: {future.exception()}")
+
+def prerender_qr_variants(token, gym_id, logo_url, variants=EAGER_VARIANTS):
+    """Queue background rendering of the common variants of a new QR code.
+
+    Skipped (the variants then render on first request) when the gym's logo is
+    not available locally yet or the render pool is saturated.
+    """
+    logo_digest, logo_png = load_gym_logo_bytes(gym_id, logo_url)
+    if logo_url and logo_digest is None:
+        return None
+    styles = [variant_style(size, image_format) for size, image_format in variants]
+    try:
+        future = render_pool.submit(render_variants_to_cache, token, logo_digest, logo_png, styles)
+    except PoolSaturated:
+        return None
+    future.add_done_callback(_report_prerender_failure)
+    return future
+
+def get_or_render_qr(token, gym_id, logo_url, style=QR_STYLE):
+    """Return (cache key, image bytes), rendering and storing the image on a miss.
+
+    The key is None while the gym's logo is not available locally yet: that
+    render is served without the logo but neither cached nor given an ETag.
+    """
+    digest = logo_digest(gym_id, logo_url)
+    if logo_url and digest is None:
+        schedule_logo_refresh(gym_id, logo_url)
+        return None, render_qr(token, None, style)
+
+    # The key needs only the digest; the overlay is decoded on a cache miss
+    key = render_key(token, digest, style)
+    image = qr_image_cache.get(key)
+    if image is None:
+        loaded_digest, logo_img = load_gym_logo(gym_id, logo_url) if digest else (None, None)
+        if loaded_digest != digest:
+            # The overlay changed or vanished since the digest was read
+            return None, render_qr(token, logo_img, style)
+        image = render_qr(token, logo_img, style)
+        qr_image_cache.put(key, image)
+    return key, image
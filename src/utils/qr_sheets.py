@@ -0,0 +1,165 @@
+import io
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from PIL import Image, ImageDraw, ImageFont
+from src.utils.qr_render import QR_STYLE, qr_image_cache, render_key, render_pool, render_qr_from_bytes
+from src.utils.workers import PoolSaturated
+
+# A4 at 100 dpi, 2 x 3 QR codes per page with the machine name underneath
+PAGE_SIZE = (827, 1169)
+GRID = (2, 3)
+PAGE_MARGIN = 40
+LABEL_HEIGHT = 40
+STREAM_CHUNK_SIZE = 64 * 1024
+# Batch jobs wait this long for a free render slot before rendering inline
+SLOT_WAIT_SECONDS = 10
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only sink that lets zipfile write to a generator instead of a file."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _cached_or_submit(entry, logo_digest, logo_png, cacheable, style):
+    """Return (key, PNG bytes or None, future or None) for one entry."""
+    key = render_key(entry['token'], logo_digest, style)
+    png = qr_image_cache.get(key) if cacheable else None
+    if png is not None:
+        return key, png, None
+    try:
+        return key, None, render_pool.submit_within(SLOT_WAIT_SECONDS, render_qr_from_bytes, entry['token'], logo_png, style)
+    except PoolSaturated:
+        png = render_qr_from_bytes(entry['token'], logo_png, style)
+        if cacheable:
+            qr_image_cache.put(key, png)
+        return key, png, None
+
+def iter_rendered_qr_codes(entries, logo_digest, logo_png, cacheable=True, style=QR_STYLE, lookahead=None):
+    """Yield (entry, PNG bytes) for every entry, rendering cache misses in parallel.
+
+    entries are dicts with at least a 'token' key. Order is not preserved:
+    images are yielded as soon as they are ready, with at most lookahead
+    renders in flight, so only that many images are held at once.
+    """
+    lookahead = lookahead or render_pool.max_workers * 2
+    futures = {}
+    for entry in entries:
+        key, png, future = _cached_or_submit(entry, logo_digest, logo_png, cacheable, style)
+        if future is None:
+            yield entry, png
+            continue
+        futures[future] = (entry, key)
+        while len(futures) >= lookahead:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _resolve(futures.pop(future) + (None, future), cacheable)
+
+    for future in as_completed(futures):
+        yield _resolve(futures[future] + (None, future), cacheable)
+
+def iter_rendered_qr_codes_in_order(entries, logo_digest, logo_png, cacheable=True, style=QR_STYLE, lookahead=None):
+    """Like iter_rendered_qr_codes, but in the order of entries."""
+    lookahead = lookahead or render_pool.max_workers * 2
+    pending = deque()
+    for entry in entries:
+        pending.append((entry,) + _cached_or_submit(entry, logo_digest, logo_png, cacheable, style))
+        while len(pending) > lookahead or (pending and pending[0][3] is None):
+            yield _resolve(pending.popleft(), cacheable)
+    while pending:
+        yield _resolve(pending.popleft(), cacheable)
+
+def _resolve(item, cacheable):
+    entry, key, png, future = item
+    if future is not None:
+        png = future.result()
+        if cacheable:
+            qr_image_cache.put(key, png)
+    return entry, png
+
+def stream_qr_zip(rendered):
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for entry, png in rendered:
+            # PNGs are already deflated, so entries are stored as-is
+            archive.writestr(f"qr_code_machine_{entry['machine_id']}.png", png)
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk
+
+def _load_font(size):
+    try:
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size)
+    except Exception:
+        return ImageFont.load_default()
+
+def _draw_page(cells, font):
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    cols, rows = GRID
+    cell_w = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // cols
+    cell_h = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // rows
+    qr_size = min(cell_w, cell_h - LABEL_HEIGHT) - 20
+
+    for index, (entry, png) in enumerate(cells):
+        col, row = index % cols, index // cols
+        x = PAGE_MARGIN + col * cell_w + (cell_w - qr_size) // 2
+        y = PAGE_MARGIN + row * cell_h
+        qr_img = Image.open(io.BytesIO(png)).convert('RGB').resize((qr_size, qr_size), Image.NEAREST)
+        page.paste(qr_img, (x, y))
+        label = entry.get('name') or f"Machine {entry['machine_id']}"
+        text_w = draw.textlength(label, font=font)
+        draw.text((PAGE_MARGIN + col * cell_w + (cell_w - text_w) / 2, y + qr_size + 8), label, fill='black', font=font)
+    return page
+
+def stream_qr_pdf(rendered):
+    """Lay the QR codes out on printable pages and stream the resulting PDF.
+
+    rendered is consumed lazily in the order given (see
+    iter_rendered_qr_codes_in_order), and pages are appended one at a time to a
+    temporary file, so only one page of images is held in memory regardless of
+    how many machines the gym has.
+    """
+    per_page = GRID[0] * GRID[1]
+    font = _load_font(20)
+    fd, pdf_path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        pages_written = 0
+        cells = []
+        for item in rendered:
+            cells.append(item)
+            if len(cells) == per_page:
+                _draw_page(cells, font).save(pdf_path, 'PDF', resolution=100.0, append=pages_written > 0)
+                pages_written += 1
+                cells = []
+        if cells or not pages_written:
+            _draw_page(cells, font).save(pdf_path, 'PDF', resolution=100.0, append=pages_written > 0)
+
+        with open(pdf_path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(pdf_path)
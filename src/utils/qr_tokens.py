@@ -0,0 +1,80 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import secrets
+
+# Self-verifying QR tokens: fc1.<key id>.<machine id>.<gym id>.<nonce>.<signature>
+# The signature is a truncated HMAC-SHA256 over everything before it, so forged or
+# malformed tokens are rejected without a database lookup (callers still check that
+# a valid one belongs to a stored QR code, see lookup_qr_payload). Keys come from
+# QR_SIGNING_KEYS ("kid:secret,kid:secret"); QR_SIGNING_KEY_ID picks the one used
+# for new tokens. Removing a kid from the list retires every token signed with it.
+# Without QR_SIGNING_KEYS a single key "k1" is derived from QR_ENCRYPTION_KEY.
+TOKEN_PREFIX = 'fc1'
+SIGNATURE_BYTES = 16
+_SIGNED_TOKEN = re.compile(r'^fc1\.([A-Za-z0-9]{1,16})\.(\d{1,12})\.(\d{1,12})\.([A-Za-z0-9_-]{8,32})\.([A-Za-z0-9_-]{22})$')
+# Opaque tokens issued before signing existed: secrets.token_urlsafe(32)
+_LEGACY_TOKEN = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+_keys_cache = {}
+
+
+class InvalidQRToken(Exception):
+    pass
+
+
+def _signing_keys():
+    configured = os.getenv('QR_SIGNING_KEYS', '')
+    current_kid = os.getenv('QR_SIGNING_KEY_ID', '')
+    cache_key = (configured, current_kid, os.getenv('QR_ENCRYPTION_KEY', ''))
+    if cache_key not in _keys_cache:
+        keys = {}
+        for item in filter(None, (part.strip() for part in configured.split(','))):
+            kid, _, secret = item.partition(':')
+            if not kid.isalnum() or not secret:
+                raise RuntimeError(f"Malformed QR_SIGNING_KEYS entry for key id '{kid}'")
+            keys[kid] = secret.encode()
+        if not keys:
+            encryption_key = os.getenv('QR_ENCRYPTION_KEY')
+            if not encryption_key:
+                raise RuntimeError("QR_SIGNING_KEYS or QR_ENCRYPTION_KEY environment variable must be set")
+            keys['k1'] = hmac.new(encryption_key.encode(), b'fitcode-qr-signing', hashlib.sha256).digest()
+        current_kid = current_kid or next(iter(keys))
+        if current_kid not in keys:
+            raise RuntimeError(f"QR_SIGNING_KEY_ID '{current_kid}' is not in QR_SIGNING_KEYS")
+        _keys_cache.clear()
+        _keys_cache[cache_key] = (current_kid, keys)
+    return _keys_cache[cache_key]
+
+def _sign(key, message):
+    digest = hmac.new(key, message.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+def issue_signed_token(machine_id, gym_id):
+    kid, keys = _signing_keys()
+    message = f'{TOKEN_PREFIX}.{kid}.{int(machine_id)}.{int(gym_id)}.{secrets.token_urlsafe(8)}'
+    return f'{message}.{_sign(keys[kid], message)}'
+
+def is_signed_token(token):
+    return token.startswith(TOKEN_PREFIX + '.')
+
+def is_legacy_token(token):
+    return bool(_LEGACY_TOKEN.match(token))
+
+def verify_signed_token(token):
+    """Return {'machine_id', 'gym_id'} for a valid signed token, else raise InvalidQRToken."""
+    match = _SIGNED_TOKEN.match(token)
+    if not match:
+        raise InvalidQRToken('Malformed QR token')
+
+    kid, machine_id, gym_id = match.group(1), match.group(2), match.group(3)
+    key = _signing_keys()[1].get(kid)
+    if key is None:
+        raise InvalidQRToken(f"Unknown QR signing key '{kid}'")
+
+    message, _, signature = token.rpartition('.')
+    if not hmac.compare_digest(_sign(key, message), signature):
+        raise InvalidQRToken('QR token signature mismatch')
+    return {'machine_id': int(machine_id), 'gym_id': int(gym_id)}
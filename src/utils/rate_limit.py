@@ -0,0 +1,84 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from flask import request
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are per process only
+    fcntl = None
+
+_SLOT = struct.Struct('dd')  # tokens, last refill (unix time)
+
+
+class SharedTokenBucket:
+    """Per-key token buckets shared by every worker process on the host.
+
+    Buckets live in a memory-mapped file guarded by flock, so gunicorn workers
+    draw from the same budget. Keys hash into a fixed number of slots; the rare
+    collision just makes two clients share a bucket.
+    """
+
+    def __init__(self, name, rate, burst, slots=8192, directory=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.slots = slots
+        self.path = os.path.join(directory or tempfile.gettempdir(), f'fitcode-ratelimit-{name}.bin')
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._pid = None
+        self.allowed = 0
+        self.limited = 0
+
+    def _ensure_map(self):
+        if self._map is None or self._pid != os.getpid():
+            size = self.slots * _SLOT.size
+            self._file = open(self.path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        return self._map
+
+    def allow(self, key, cost=1.0):
+        """Take cost tokens from key's bucket; return (allowed, seconds until retry)."""
+        slot = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') % self.slots
+        offset = slot * _SLOT.size
+        with self._lock:
+            shared = self._ensure_map()
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                tokens, last = _SLOT.unpack_from(shared, offset)
+                now = time.time()
+                tokens = min(self.burst, tokens + max(now - last, 0) * self.rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                _SLOT.pack_into(shared, offset, tokens, now)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        if allowed:
+            self.allowed += 1
+            return True, 0.0
+        self.limited += 1
+        return False, (cost - tokens) / self.rate
+
+    def stats(self):
+        return {'rate': self.rate, 'burst': self.burst, 'allowed': self.allowed, 'limited': self.limited}
+
+
+def client_ip():
+    # Each trusted proxy in front of us (Render's router by default) appends one hop
+    hops = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 1))
+    route = request.access_route
+    if hops and len(route) >= hops and request.headers.get('X-Forwarded-For'):
+        return route[-hops]
+    return request.remote_addr or 'unknown'
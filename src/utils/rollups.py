@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import bindparam, delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from src.models.gym import db, GymMachine, ScanDailyRollup, ScanHistory
+from src.utils.scan_recorder import scan_recorder
+from src.utils.hll import HyperLogLog
+
+# scan_daily_rollups holds one row per (machine, UTC day): the scan count and a
+# HyperLogLog sketch of the distinct clients. Scans add to it in the same
+# transaction that inserts them, so analytics read a handful of rows per
+# machine and day instead of every scan. rebuild_rollups recomputes a window
+# from scan_history (backfill after the migration, or repair). Sketches cannot
+# forget a client, so after a client purge distinct-user estimates may count
+# them until the affected days are rebuilt.
+#
+# Rollups are derived data and must never cost a scan: the upsert runs in a
+# savepoint, and if it fails the scans still commit and their days are marked
+# stale. Stale days are rebuilt from scan_history after a later flush, at most
+# every ROLLUP_REPAIR_INTERVAL seconds. Marks live in the worker, so days still
+# stale when a worker dies are left for `scripts/rollup_scans.py --verify`.
+
+UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+ROLLUP_REPAIR_INTERVAL = float(os.getenv('ROLLUP_REPAIR_INTERVAL', 60))
+
+_stale_days = set()
+_stale_lock = threading.Lock()
+_last_repair = 0.0
+
+
+def _resolve_gym_ids(machine_ids):
+    if not machine_ids:
+        return {}
+    return dict(db.session.execute(
+        select(GymMachine.id, GymMachine.gym_id).where(GymMachine.id.in_(machine_ids))
+    ).all())
+
+def add_to_rollups(counts):
+    """Add {(gym_id, machine_id, day): scans} to the rollup table."""
+    if not counts:
+        return
+    execute = db.session.execute
+    # Sorted so concurrent flushes lock the same rows in the same order
+    rows = sorted((
+        {'gym_id': gym_id, 'machine_id': machine_id, 'day': day, 'scan_count': count}
+        for (gym_id, machine_id, day), count in counts.items()
+    ), key=lambda row: (row['machine_id'], row['day']))
+    dialect = db.session.get_bind().dialect.name
+    upsert = UPSERT_DIALECTS.get(dialect)
+    if upsert is not None:
+        stmt = upsert(ScanDailyRollup)
+        execute(stmt.on_conflict_do_update(
+            index_elements=['machine_id', 'day'],
+            set_={'scan_count': ScanDailyRollup.scan_count + stmt.excluded.scan_count}
+        ), rows)
+        return
+    for row in rows:
+        result = execute(update(ScanDailyRollup).where(
+            ScanDailyRollup.machine_id == row['machine_id'], ScanDailyRollup.day == row['day']
+        ).values(scan_count=ScanDailyRollup.scan_count + row['scan_count']))
+        if result.rowcount == 0:
+            execute(insert(ScanDailyRollup), [row])
+
+@scan_recorder.on_write
+def roll_up_scans(scans):
+    try:
+        with db.session.begin_nested():
+            _roll_up(scans)
+    except Exception as e:
+        days = {scan['scan_timestamp'].date() for scan in scans}
+        mark_stale_days(days)
+        print(f"Rollup update failed for {len(scans)} scans, days {sorted(map(str, days))} marked for rebuild: {e}")
+
+def _roll_up(scans):
+    missing = {scan['machine_id'] for scan in scans if scan['gym_id'] is None}
+    gym_ids = _resolve_gym_ids(missing)
+    counts = Counter(
+        (scan['gym_id'] or gym_ids.get(scan['machine_id']), scan['machine_id'], scan['scan_timestamp'].date())
+        for scan in scans
+    )
+    add_to_rollups(counts)
+
+    clients = {}
+    for scan in scans:
+        clients.setdefault((scan['machine_id'], scan['scan_timestamp'].date()), set()).add(scan['client_id'])
+    add_to_sketches(clients)
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+_sketch_update = update(ScanDailyRollup.__table__).where(
+    ScanDailyRollup.__table__.c.machine_id == bindparam('key_machine_id'),
+    ScanDailyRollup.__table__.c.day == bindparam('key_day')
+).values(client_sketch=bindparam('sketch'))
+
+def add_to_sketches(clients):
+    """Fold {(machine_id, day): client ids} into the rows' sketches.
+
+    Runs after add_to_rollups in the same transaction; its upsert already holds
+    the rows' write locks, so concurrent flushes cannot lose each other's updates.
+    """
+    if not clients:
+        return
+    execute = db.session.execute
+    stored = execute(
+        select(ScanDailyRollup.machine_id, ScanDailyRollup.day, ScanDailyRollup.client_sketch)
+        .where(tuple_(ScanDailyRollup.machine_id, ScanDailyRollup.day).in_(list(clients)))
+    ).all()
+    changed = []
+    for machine_id, day, sketch_bytes in stored:
+        sketch = HyperLogLog.from_bytes(sketch_bytes)
+        if sketch.update(clients.get((machine_id, _as_date(day)), ())) or sketch_bytes is None:
+            changed.append({'key_machine_id': machine_id, 'key_day': _as_date(day), 'sketch': sketch.to_bytes()})
+    if changed:
+        changed.sort(key=lambda row: (row['key_machine_id'], row['key_day']))
+        execute(_sketch_update, changed)
+
+def merged_sketch(rows):
+    """Merge serialized sketches (e.g. a window's rollup rows) into one HyperLogLog."""
+    sketch = HyperLogLog()
+    for sketch_bytes in rows:
+        sketch.merge_bytes(sketch_bytes)
+    return sketch
+
+def subtract_scans(scan_ids):
+    """Take scans out of the rollups, in the caller's transaction, before they are deleted."""
+    day = func.date(ScanHistory.scan_timestamp)
+    rows = db.session.execute(
+        select(ScanHistory.machine_id, day, func.count(ScanHistory.id))
+        .where(ScanHistory.id.in_(scan_ids))
+        .group_by(ScanHistory.machine_id, day)
+        .order_by(ScanHistory.machine_id, day)
+    ).all()
+    for machine_id, scan_day, count in rows:
+        if isinstance(scan_day, str):
+            scan_day = date.fromisoformat(scan_day)
+        db.session.execute(update(ScanDailyRollup).where(
+            ScanDailyRollup.machine_id == machine_id, ScanDailyRollup.day == scan_day
+        ).values(scan_count=ScanDailyRollup.scan_count - count))
+    return len(rows)
+
+def rebuild_rollups(connection, start_day=None, gym_id=None, end_day=None):
+    """Recompute rollups for days >= start_day (all history when None) and
+    < end_day (open when None), optionally for one gym, from scan_history in a
+    single INSERT ... SELECT, then their client sketches. Returns rows written."""
+    clear = delete(ScanDailyRollup)
+    if start_day is not None:
+        clear = clear.where(ScanDailyRollup.day >= start_day)
+    if end_day is not None:
+        clear = clear.where(ScanDailyRollup.day < end_day)
+    if gym_id is not None:
+        clear = clear.where(ScanDailyRollup.gym_id == gym_id)
+    connection.execute(clear)
+
+    day = func.date(ScanHistory.scan_timestamp)
+    aggregate = select(
+        GymMachine.gym_id, ScanHistory.machine_id, day, func.count(ScanHistory.id)
+    ).join(GymMachine, ScanHistory.machine_id == GymMachine.id)
+    if start_day is not None:
+        aggregate = aggregate.where(ScanHistory.scan_timestamp >= start_day)
+    if end_day is not None:
+        aggregate = aggregate.where(ScanHistory.scan_timestamp < end_day)
+    if gym_id is not None:
+        aggregate = aggregate.where(GymMachine.gym_id == gym_id)
+    aggregate = aggregate.group_by(GymMachine.gym_id, ScanHistory.machine_id, day)
+
+    result = connection.execute(insert(ScanDailyRollup).from_select(
+        ['gym_id', 'machine_id', 'day', 'scan_count'], aggregate
+    ))
+    rebuild_sketches(connection, start_day=start_day, gym_id=gym_id, end_day=end_day)
+    return result.rowcount
+
+def rebuild_sketches(connection, start_day=None, gym_id=None, batch_size=1000, end_day=None):
+    """Recompute client sketches from scan_history, streaming distinct
+    (machine, day, client) triples in order so one sketch is in memory at a time."""
+    day = func.date(ScanHistory.scan_timestamp)
+    triples = select(ScanHistory.machine_id, day, ScanHistory.client_id).distinct()
+    if gym_id is not None:
+        triples = triples.join(GymMachine, ScanHistory.machine_id == GymMachine.id).where(GymMachine.gym_id == gym_id)
+    if start_day is not None:
+        triples = triples.where(ScanHistory.scan_timestamp >= start_day)
+    if end_day is not None:
+        triples = triples.where(ScanHistory.scan_timestamp < end_day)
+    triples = triples.order_by(ScanHistory.machine_id, day)
+
+    pending = []
+    current, sketch = None, None
+    rows = connection.execution_options(stream_results=True, yield_per=batch_size).execute(triples)
+    for machine_id, scan_day, client_id in rows:
+        key = (machine_id, _as_date(scan_day))
+        if key != current:
+            if current is not None:
+                pending.append({'key_machine_id': current[0], 'key_day': current[1], 'sketch': sketch.to_bytes()})
+            current, sketch = key, HyperLogLog()
+        sketch.add(client_id)
+        if len(pending) >= batch_size:
+            connection.execute(_sketch_update, pending)
+            pending = []
+    if current is not None:
+        pending.append({'key_machine_id': current[0], 'key_day': current[1], 'sketch': sketch.to_bytes()})
+    if pending:
+        connection.execute(_sketch_update, pending)
+
+def mark_stale_days(days):
+    with _stale_lock:
+        _stale_days.update(days)
+
+def stale_days():
+    with _stale_lock:
+        return sorted(_stale_days)
+
+def repair_stale_rollups():
+    """Rebuild each stale day in its own transaction; days that fail stay marked."""
+    with _stale_lock:
+        days = sorted(_stale_days)
+        _stale_days.difference_update(days)
+    repaired = []
+    for day in days:
+        try:
+            with db.engine.begin() as connection:
+                rebuild_rollups(connection, start_day=day, end_day=day + timedelta(days=1))
+            repaired.append(day)
+        except Exception as e:
+            mark_stale_days([day])
+            print(f"Rollup rebuild of {day} failed, will retry: {e}")
+    if repaired:
+        print(f"Rebuilt rollups for {', '.join(map(str, repaired))}")
+    return repaired
+
+@scan_recorder.on_flush
+def repair_rollups_after_flush(scans):
+    global _last_repair
+    if not _stale_days or time.monotonic() - _last_repair < ROLLUP_REPAIR_INTERVAL:
+        return
+    _last_repair = time.monotonic()
+    repair_stale_rollups()
+
+def window_start_day(days):
+    """First UTC day of an analytics window of `days` days ending now."""
+    return (datetime.utcnow() - timedelta(days=days)).date()
@@ -0,0 +1,46 @@
+import os
+from flask import current_app
+from src.models.gym import db, Gym, GymMachine, MultilingualContent
+from src.utils.cache import TTLCache
+from src.utils.purge import on_machine_purged
+
+# Ready-to-send scan responses per machine: machine + gym + multilingual content,
+# serialized once. Values are (gym_id, JSON bytes). Routes that change any of the
+# inputs invalidate explicitly; the TTL bounds staleness across workers.
+scan_card_cache = TTLCache(
+    maxsize=int(os.getenv('SCAN_CARD_CACHE_SIZE', 5000)),
+    ttl=int(os.getenv('SCAN_CARD_CACHE_TTL', 300))
+)
+
+def build_scan_card(machine_id):
+    machine = db.session.get(GymMachine, machine_id)
+    if not machine:
+        raise LookupError('Machine not found')
+
+    gym = db.session.get(Gym, machine.gym_id)
+    if not gym:
+        raise LookupError('Gym not found')
+
+    multilingual_content = MultilingualContent.query.filter_by(machine_id=machine.id).all()
+    body = current_app.json.dumps({
+        'message': 'QR code scanned successfully',
+        'machine': machine.to_dict(),
+        'gym': gym.to_dict(),
+        'multilingual_content': [content.to_dict() for content in multilingual_content]
+    })
+    return gym.id, body.encode()
+
+def get_scan_card(machine_id):
+    """Return (gym_id, JSON bytes); raises LookupError if the machine or gym is gone."""
+    card = scan_card_cache.get(machine_id)
+    if card is None:
+        card = build_scan_card(machine_id)
+        scan_card_cache.set(machine_id, card)
+    return card
+
+@on_machine_purged
+def invalidate_machine_card(machine_id):
+    scan_card_cache.invalidate(machine_id)
+
+def invalidate_gym_cards(gym_id):
+    scan_card_cache.invalidate_where(lambda machine_id, card: card[0] == gym_id)
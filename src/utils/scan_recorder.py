@@ -0,0 +1,201 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert
+from src.models.gym import db, ScanHistory
+
+
+class ScanRecorder:
+    """Write-behind buffer for ScanHistory rows.
+
+    Scans are queued in memory and a background thread bulk-inserts them once
+    batch_size events are waiting or flush_interval seconds have passed. The
+    queue is flushed on worker shutdown; a hard kill loses at most one interval.
+    Functions registered with on_write run inside each batch's transaction;
+    functions registered with on_flush run with each committed batch, in the
+    worker that recorded it.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_queue=20000, enabled=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self.app = None
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+        self._write_hooks = []
+        self._flush_hooks = []
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.shutdown)
+
+    def on_write(self, fn):
+        """Register fn(scans) to run in the same transaction as the scans' insert,
+        for data that must stay consistent with scan_history. Raising aborts the
+        batch."""
+        self._write_hooks.append(fn)
+        return fn
+
+    def on_flush(self, fn):
+        """Register fn(scans) to run after scans are committed; each scan is a dict
+        with client_id, machine_id, gym_id (None if the caller did not know it)
+        and scan_timestamp."""
+        self._flush_hooks.append(fn)
+        return fn
+
+    def record(self, client_id, machine_id, gym_id=None):
+        scan = {
+            'client_id': client_id,
+            'machine_id': machine_id,
+            'gym_id': gym_id,
+            'scan_timestamp': datetime.utcnow()
+        }
+        self.recorded += 1
+        if not self.enabled:
+            self._write([scan])
+            return
+
+        with self._lock:
+            self._queue.append(scan)
+            depth = len(self._queue)
+        self._ensure_thread()
+        if depth >= self.max_queue:
+            # The flusher is falling behind; make the caller pay for one flush
+            self.flush()
+        elif depth >= self.batch_size:
+            self._wake.set()
+
+    def discard(self, machine_id=None, client_id=None):
+        """Drop queued scans of a machine or client that is being deleted."""
+        with self._lock:
+            kept = deque(
+                scan for scan in self._queue
+                if not (machine_id is not None and scan['machine_id'] == machine_id)
+                and not (client_id is not None and scan['client_id'] == client_id)
+            )
+            discarded = len(self._queue) - len(kept)
+            self._queue = kept
+        self.discarded += discarded
+        return discarded
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so start one lazily in each worker
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='scan-recorder', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Scan recorder flush failed: {e}")
+
+    def _take_batch(self):
+        with self._lock:
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return
+                started = time.perf_counter()
+                with self.app.app_context():
+                    self._write(batch)
+                    db.session.remove()
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self.total_flush_ms += elapsed_ms
+
+    def _notify(self, scans):
+        for hook in self._flush_hooks:
+            try:
+                hook(scans)
+            except Exception as e:
+                print(f"Scan flush hook {hook.__name__} failed: {e}")
+
+    def _write(self, batch):
+        # gym_id travels with the event for the flush hooks; scan_history has no such column
+        rows = [{key: value for key, value in scan.items() if key != 'gym_id'} for scan in batch]
+        try:
+            db.session.execute(insert(ScanHistory), rows)
+            for hook in self._write_hooks:
+                hook(batch)
+            db.session.commit()
+            self.flushed += len(batch)
+            self._notify(batch)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Batch insert of {len(batch)} scans failed, retrying row by row: {e}")
+            # A single bad row (e.g. a machine deleted meanwhile) must not sink the batch
+            written = []
+            for scan, row in zip(batch, rows):
+                try:
+                    db.session.execute(insert(ScanHistory), [row])
+                    for hook in self._write_hooks:
+                        hook([scan])
+                    db.session.commit()
+                    self.flushed += 1
+                    written.append(scan)
+                except Exception as row_error:
+                    db.session.rollback()
+                    self.dropped += 1
+                    print(f"Dropping scan {scan}: {row_error}")
+            if written:
+                self._notify(written)
+
+    def shutdown(self):
+        self._stopping = True
+        self._wake.set()
+        if self.app is not None and self._queue:
+            self.flush()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'queue_depth': len(self._queue),
+            'recorded': self.recorded,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'discarded': self.discarded,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
+
+
+scan_recorder = ScanRecorder(
+    batch_size=int(os.getenv('SCAN_FLUSH_BATCH_SIZE', 200)),
+    flush_interval=float(os.getenv('SCAN_FLUSH_INTERVAL', 1.0)),
+    max_queue=int(os.getenv('SCAN_MAX_QUEUE', 20000)),
+    enabled=os.getenv('SCAN_WRITE_BEHIND', '1') == '1'
+)
@@ -0,0 +1,224 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+from flask import request, Response
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+from src.utils.content_cache import write_atomic
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are still served
+    brotli = None
+
+# Bundler output whose name changes whenever the content does, so it can be cached
+# forever: a hex content hash between dots (app.3f9a1c2e.js) or Vite's eight-character
+# hash in its assets directory (assets/index-B1x9Qz3k.js). Everything else (index.html,
+# favicon, android-chrome-192x192.png) is revalidated against its ETag on each use.
+FINGERPRINTED = re.compile(
+    r'(\.[0-9a-f]{8,}|^assets/(?:.*/)?[^/]*-(?=[A-Za-z_-]*\d)(?=[0-9_-]*[A-Za-z])[A-Za-z0-9_-]{8})\.[A-Za-z0-9]+$'
+)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/xml', 'application/wasm', 'application/manifest+json')
+MIN_COMPRESS_SIZE = 1024
+# Preferred first when the client accepts several
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Written into the static root by scripts/build_static_manifest.py at deploy time
+MANIFEST_NAME = '.static-manifest.json'
+# Top-level directories served by their own routes, never through the manifest;
+# videos can be large and numerous, so they are neither walked nor hashed
+MEDIA_DIRS = ('videos',)
+
+
+def _is_compressible(path):
+    mimetype = mimetypes.guess_type(path)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES) or path.endswith(('.js', '.mjs', '.css', '.map'))
+
+def _file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def precompress(path):
+    """Write missing .gz (and .br when brotli is installed) siblings of a static file."""
+    if not _is_compressible(path) or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return []
+    written = []
+    data = None
+    for encoding, suffix in ENCODINGS:
+        target = path + suffix
+        if encoding == 'br' and brotli is None:
+            continue
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        # Only worth keeping if it actually saves bytes
+        if len(compressed) < len(data):
+            write_atomic(target, compressed)
+            written.append(target)
+    return written
+
+
+class StaticManifest:
+    """In-memory table of the SPA's static files.
+
+    Content hashes are computed at deploy time by scripts/build_static_manifest.py
+    (build + save), which also writes the compressed variants. Workers only load
+    that file and stat the tree, so startup never reads file contents. A file the
+    manifest does not cover (added or changed after the deploy, or no manifest at
+    all in development) gets an ETag from its size and mtime instead.
+    """
+
+    def __init__(self, root, exclude=MEDIA_DIRS):
+        self.root = root
+        self.exclude = set(exclude)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _files(self):
+        if not self.root or not os.path.isdir(self.root):
+            return
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')
+                           and not (dirpath == self.root and d in self.exclude)]
+            names = set(filenames)
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                # Pre-built variants belong to their original file
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for _, suffix in ENCODINGS):
+                    continue
+                path = os.path.join(dirpath, name)
+                yield path, os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def build(self):
+        """Hash every file; deploy-time work, see load() for what workers do."""
+        entries = {relative: self._entry(path, relative, _file_digest(path)[:32])
+                   for path, relative in self._files()}
+        with self._lock:
+            self.entries = entries
+            self._loaded = True
+        return len(entries)
+
+    def save(self):
+        recorded = {relative: {'etag': entry['etag'], 'size': entry['size'], 'mtime_ns': entry['mtime_ns']}
+                    for relative, entry in self.entries.items()}
+        write_atomic(os.path.join(self.root, MANIFEST_NAME), json.dumps(recorded, sort_keys=True).encode())
+
+    def load(self):
+        """Take content hashes from the saved manifest for files whose size and
+        mtime still match it; stat-based ETags for everything else."""
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME)) as f:
+                recorded = json.load(f)
+        except (TypeError, FileNotFoundError, ValueError):
+            recorded = {}
+        entries = {}
+        for path, relative in self._files():
+            entry = self._entry(path, relative)
+            saved = recorded.get(relative)
+            if saved and saved['size'] == entry['size'] and saved['mtime_ns'] == entry['mtime_ns']:
+                entry['etag'] = saved['etag']
+            entries[relative] = entry
+        with self._lock:
+            self.entries = entries
+            self._loaded = True
+        return len(entries)
+
+    def _entry(self, path, relative, digest=None):
+        stat = os.stat(path)
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+        return {
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'etag': digest or f'{stat.st_mtime_ns:x}-{stat.st_size:x}',
+            'mimetype': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'cache_control': (IMMUTABLE_CACHE_CONTROL if FINGERPRINTED.search(relative)
+                              else REVALIDATE_CACHE_CONTROL),
+            'variants': variants
+        }
+
+    def _discover(self, relative):
+        # One stat for a path the manifest does not know: a file added after startup
+        parts = relative.split('/')
+        if parts[0] in self.exclude or any(part.startswith('.') for part in parts):
+            return None
+        path = safe_join(self.root, relative) if self.root else None
+        if path is None or not os.path.isfile(path):
+            return None
+        entry = self._entry(path, relative)
+        with self._lock:
+            self.entries[relative] = entry
+        return entry
+
+    def lookup(self, path):
+        if not self._loaded:
+            self.load()
+        return self.entries.get(path) or self._discover(path)
+
+    def forget(self, path):
+        """Drop an entry whose file went away; the next lookup stats it again."""
+        with self._lock:
+            self.entries.pop(path, None)
+
+    def stats(self):
+        return {
+            'root': self.root,
+            'files': len(self.entries),
+            'precompressed': sum(1 for entry in self.entries.values() if entry['variants']),
+            'brotli_available': brotli is not None
+        }
+
+
+def _accepted_encodings():
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if token and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(token.lower())
+    return accepted
+
+def send_static_entry(entry):
+    """Serve a manifest entry, picking a pre-built variant by Accept-Encoding."""
+    path, size, etag = entry['path'], entry['size'], entry['etag']
+    headers = {'Cache-Control': entry['cache_control'], 'Vary': 'Accept-Encoding'}
+
+    accepted = _accepted_encodings()
+    for encoding, _ in ENCODINGS:
+        if encoding in entry['variants'] and encoding in accepted:
+            path, size = entry['variants'][encoding]
+            etag = f'{etag}-{encoding}'
+            headers['Content-Encoding'] = encoding
+            break
+    headers['ETag'] = f'"{etag}"'
+
+    if etag in [tag.strip(' "') for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return Response(status=304, headers=headers)
+
+    headers['Content-Length'] = str(size)
+    if request.method == 'HEAD':
+        return Response(mimetype=entry['mimetype'], headers=headers)
+    body = wrap_file(request.environ, open(path, 'rb'))
+    return Response(body, mimetype=entry['mimetype'], headers=headers, direct_passthrough=True)
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Pools are created from request threads, and forking a threaded process can
+# leave a child holding a lock some other thread owned. forkserver (or spawn
+# where it is unavailable) starts children from a clean single-threaded process.
+START_METHOD = os.getenv('PROCESS_POOL_START_METHOD', 'forkserver')
+
+
+def _mp_context():
+    if START_METHOD in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context(START_METHOD)
+    return multiprocessing.get_context('spawn')
+
+
+class PoolSaturated(Exception):
+    """Raised when a pool already has as many jobs in flight as it accepts."""
+
+
+class BoundedProcessPool:
+    """Process pool with a hard cap on queued + running jobs.
+
+    The executor is created lazily and re-created after a fork, so every
+    gunicorn worker owns its own children instead of sharing the master's.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, acquire_timeout=0.05):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def _ensure_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_mp_context())
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._in_flight = 0
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_within(self.acquire_timeout, fn, *args, **kwargs)
+
+    def submit_within(self, acquire_timeout, fn, *args, **kwargs):
+        executor, slots = self._ensure_executor()
+        if not slots.acquire(timeout=acquire_timeout):
+            self.rejected += 1
+            raise PoolSaturated(f'{fn.__name__}: {self.max_pending} jobs already pending')
+
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        with self._lock:
+            self._in_flight += 1
+            self.submitted += 1
+        future.add_done_callback(lambda _: self._release(slots))
+        return future
+
+    def _release(self, slots):
+        with self._lock:
+            if slots is self._slots:
+                self._in_flight -= 1
+        slots.release()
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        in_flight = self._in_flight if self._pid == os.getpid() else 0
+        return {
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'in_flight': in_flight,
+            'submitted': self.submitted,
+            'rejected': self.rejected
+        }